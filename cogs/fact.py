@@ -1,16 +1,25 @@
 import asyncio
+import contextlib
 import json
 import random
 import re
 import time
 
+import aiohttp
 import discord
 import wikipedia
 from discord import app_commands
 from discord.ext import commands
 from repositories.wiki_repo import FactsView
 from utils.gemini import gemini_client
-from utils.wiki import create_false_statement, get_wiki_facts, get_wiki_image
+from utils.members import member_index
+from utils.messages import message_store
+from utils.summarizer import summarizer
+from utils.warmer import DISCUSS, SEARCH, topic_usage
+from utils.webhooks import webhook_registry
+from utils.wiki import create_false_statements, get_wiki_facts, get_wiki_image
+
+MESSAGE_LINK = re.compile(r"^(?:https:\/\/discord\.com\/channels\/\d+\/\d+\/)*(\d+)$")
 
 
 class FactCommand(commands.Cog):
@@ -24,14 +33,16 @@ class FactCommand(commands.Cog):
     async def discuss(self, interaction: discord.Interaction, topic: str) -> None:
         """Create a discussion on the given topic."""
         await interaction.response.defer()
+        topic_usage.record(interaction.guild_id, DISCUSS, topic)
 
-        # Generate convo from gemini
-        conversation = await gemini_client.generate_conversation(topic)
-        data = json.loads(conversation)
+        # Generate convo from gemini, streamed message by message
+        messages = gemini_client.stream_conversation(topic)
+        first_message = await anext(messages, {})
 
         # Verify data structure
-        if isinstance(data, dict):
-            message = data.get("summary", "Failed to generate a conversation on given topic.")
+        if "userid" not in first_message:
+            await messages.aclose()
+            message = first_message.get("summary", "Failed to generate a conversation on given topic.")
             embed = discord.Embed(
                 title="Error",
                 description=message,
@@ -49,33 +60,34 @@ class FactCommand(commands.Cog):
 
         # Assign users for the generated convo
         convo_starter = interaction.user
-        other_users = random.sample(
-            [member for member in interaction.guild.members if not (member.bot or member == convo_starter)],
-            k=2,
-        )
+        other_users = member_index.sample(interaction.guild, k=2, exclude=[convo_starter.id])
         users = [convo_starter, *other_users]
 
-        # Set up webhooks with server
-        webhooks = await interaction.channel.webhooks()
-        if not webhooks:
-            webhook = await interaction.channel.create_webhook(name="Discussion")
-        else:
-            for webhook in webhooks:
-                if webhook.token:
-                    break
-            else:
-                webhook = await interaction.channel.create_webhook(name="Discussion")
-
-        # Send messages
-        for message in data:
+        # Send messages while the rest is still generated, paced like typing
+        last_sent = time.monotonic()
+
+        async def send(message: dict) -> None:
+            nonlocal last_sent
             user = users[message["userid"] % len(users)]
             avatar_url = user.avatar.url if user.avatar else user.default_avatar.url
-            await asyncio.sleep(len(message["message"]) / 7)
-            await webhook.send(
+            await asyncio.sleep(last_sent + len(message["message"]) / 7 - time.monotonic())
+            await webhook_registry.send(
+                interaction.channel,
                 content=message["message"],
                 username=user.display_name,
                 avatar_url=avatar_url,
             )
+            last_sent = time.monotonic()
+
+        async with contextlib.aclosing(messages):
+            await send(first_message)
+            async for message in messages:
+                await send(message)
+
+    @commands.Cog.listener()
+    async def on_webhooks_update(self, channel: discord.abc.GuildChannel) -> None:
+        """Forget the discussion webhook of a channel whose webhooks changed."""
+        webhook_registry.invalidate(channel.id)
 
     @app_commands.command(name="summarize")
     async def summarize(self, interaction: discord.Interaction, text: str) -> None:
@@ -105,26 +117,19 @@ class FactCommand(commands.Cog):
 
         def parse_msg_id(arg: str) -> str | ValueError:
             """Verify the input arg is either msg link or msg id."""
-            if match := re.match(r"^(?:https:\/\/discord\.com\/channels\/\d+\/\d+\/)*(\d+)$", arg):
+            if match := MESSAGE_LINK.match(arg):
                 return int(match.group(1))
             raise ValueError
 
-        async def convert_user_tags(message: discord.Message) -> str:
-            def replace_tag(match: re.Match) -> str:
-                """Replace user's ID with user's display name."""
-                user_id = int(match.group(1))
-                user = message.guild.get_member(user_id)
-                return f"{user.display_name}" if user else match.group(0)
-
-            return re.sub(r"<@?(\d+)>", replace_tag, message.content)
-
         channel = interaction.channel
         await interaction.response.defer()
 
         # Messages verification
         try:
-            msg1 = await channel.fetch_message(parse_msg_id(start))
-            msg2 = await channel.fetch_message(parse_msg_id(end))
+            first_id, last_id = sorted((parse_msg_id(start), parse_msg_id(end)))
+            for message_id in (first_id, last_id):
+                if message_store.get(channel.id, message_id) is None:
+                    await channel.fetch_message(message_id)
         except (discord.NotFound, ValueError):
             embed = discord.Embed(
                 title="Error",
@@ -133,23 +138,12 @@ class FactCommand(commands.Cog):
             )
             await interaction.followup.send(embed=embed)
             return
-
-        # Ensure msg1 is the older message
-        if msg1.created_at > msg2.created_at:
-            msg1, msg2 = msg2, msg1
-
-        # Attach start and end messages
-        messages = (
-            [msg1] + [message async for message in channel.history(after=msg1, before=msg2, limit=None)] + [msg2]
-        )
-
-        # Turn into readable convo
-        msg_contents = "\n".join([f"{msg.author.display_name}: {await convert_user_tags(msg)}" for msg in messages])
+        msg1 = channel.get_partial_message(first_id)
+        msg2 = channel.get_partial_message(last_id)
 
         # Gemini summarize and return result
-        summary = await gemini_client.summarize_conversation(msg_contents)
-        if summary:
-            summarized_text = json.loads(summary)["summary"]
+        summarized_text = await summarizer.summarize(channel, message_store.history(channel, first_id, last_id))
+        if summarized_text:
             embed = discord.Embed(
                 title=f"**Summary** from {msg1.jump_url} to {msg2.jump_url}",
                 description=summarized_text,
@@ -168,10 +162,15 @@ class FactCommand(commands.Cog):
     async def search(self, interaction: discord.Interaction, entry: str, number: int = 5) -> None:
         """Generate a list of statements about topic. User must find the one that is incorrect."""
         await interaction.response.defer()
+        topic_usage.record(interaction.guild_id, SEARCH, entry)
+
+        async def get_statements() -> tuple[list, list]:
+            facts = await get_wiki_facts(entry, number=number)
+            return facts, await create_false_statements(facts)
 
-        # Fetching facts from Wiki
+        # Fetch facts and their false statements from Wiki, alongside the image
         try:
-            facts = get_wiki_facts(entry, number=number)
+            (facts, false_statements), image_url = await asyncio.gather(get_statements(), get_wiki_image(entry))
         except wikipedia.DisambiguationError:
             await interaction.followup.send(
                 f"""The prompt **{entry}** can refer to many different things, please be more specific!""",
@@ -182,11 +181,17 @@ class FactCommand(commands.Cog):
                 f"The prompt **{entry}** did not match any of our searches. Please try again with a differently worded prompt / query.",  # noqa: E501
             )
             return
+        except (TimeoutError, aiohttp.ClientError):
+            await interaction.followup.send(f"Could not reach Wikipedia for **{entry}**, please try again later.")
+            return
 
         # Alter 1 fact to become incorrect
-        false_index = random.randint(0, number - 1)  # noqa: S311
+        if not (candidates := [i for i, statement in enumerate(false_statements) if statement]):
+            await interaction.followup.send(f"Failed to create a false statement about **{entry}**, please try again.")
+            return
+        false_index = random.choice(candidates)  # noqa: S311
         correction = facts[false_index]
-        facts[false_index] = create_false_statement(facts[false_index])
+        facts[false_index] = false_statements[false_index]
 
         # Create embeds for statements
         statements_embed = discord.Embed(
@@ -196,8 +201,8 @@ class FactCommand(commands.Cog):
         )
         for i in range(len(facts)):
             statements_embed.add_field(name=f"Statement #{i+1}", value=facts[i], inline=False)
-        if url := get_wiki_image(entry):
-            statements_embed.set_thumbnail(url=url)
+        if image_url:
+            statements_embed.set_thumbnail(url=image_url)
 
         # Create embed for more info
         question_embed = discord.Embed(
@@ -217,7 +222,8 @@ class FactCommand(commands.Cog):
         """Say hello!."""
         msg = f"Hi, {interaction.user.mention}."
         fact = await gemini_client.name_fun_fact(interaction.user.display_name)
-        fact = json.loads(fact)["fun_fact"]
+        # Blocked prompts come back as a summary instead of a fact
+        fact = json.loads(fact).get("fun_fact", "False")
         if fact != "False":
             msg += f"\nDid you know: {fact}"
         await interaction.response.send_message(msg)
@@ -0,0 +1,64 @@
+import discord
+from discord import app_commands
+from discord.ext import commands
+from utils.database import db
+from utils.messages import message_store
+
+
+class MessageStoreCommand(commands.Cog):
+    """Keeps the recent messages of opted in channels, so /shortify does not page through history."""
+
+    def __init__(self, bot: commands.Bot) -> None:
+        """Initialize MessageStoreCommand cog."""
+        self.bot = bot
+
+    async def cog_load(self) -> None:
+        """Resume storing the channels that opted in."""
+        for guild_id, channel_id in await db.get_stored_channels():
+            message_store.enable(guild_id, channel_id)
+
+    @app_commands.command(name="store-messages", description="Keep recent messages of this channel for /shortify")
+    @app_commands.default_permissions(manage_channels=True)
+    @app_commands.guild_only()
+    async def store_messages(self, interaction: discord.Interaction, enabled: bool) -> None:  # noqa: FBT001
+        """Opt this channel in to or out of the message store."""
+        await db.set_channel_stored(interaction.guild_id, interaction.channel_id, stored=enabled)
+        if enabled:
+            message_store.enable(interaction.guild_id, interaction.channel_id)
+            message = "Recent messages of this channel are now kept for /shortify."
+        else:
+            message_store.disable(interaction.guild_id, interaction.channel_id)
+            message = "Messages of this channel are no longer kept."
+        await interaction.response.send_message(message, ephemeral=True)
+
+    @commands.Cog.listener()
+    async def on_ready(self) -> None:
+        """Start over after reconnecting, messages sent meanwhile were missed."""
+        message_store.reset()
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message) -> None:
+        """Store new messages."""
+        message_store.add(message)
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent) -> None:
+        """Update edited messages, whether or not discord.py has them cached."""
+        if "content" in payload.data:
+            message_store.edit(payload.guild_id, payload.channel_id, payload.message_id, payload.data["content"])
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent) -> None:
+        """Forget deleted messages."""
+        message_store.delete(payload.guild_id, payload.channel_id, payload.message_id)
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent) -> None:
+        """Forget purged messages."""
+        for message_id in payload.message_ids:
+            message_store.delete(payload.guild_id, payload.channel_id, message_id)
+
+
+async def setup(bot: commands.Bot) -> None:
+    """Setups the message store cog."""
+    await bot.add_cog(MessageStoreCommand(bot))
@@ -3,6 +3,12 @@ import random
 import discord
 from discord import app_commands
 from discord.ext import commands
+from utils.gemini import gemini_client
+from utils.http import http_client
+from utils.members import member_index
+
+# Hosts listed by /bot-stats, busiest first
+REPORTED_HOSTS = 10
 
 
 class MiscCommand(commands.Cog):
@@ -21,9 +27,61 @@ class MiscCommand(commands.Cog):
     async def randomize(self, interaction: discord.Interaction) -> None:
         """Tag a random user."""
         phrase = random.choice(["You've been chosen,", "I choose you,", "And the chosen one is"])  # noqa: S311
-        user = random.choice(interaction.channel.guild.members)  # noqa: S311
+        user = member_index.choice(interaction.channel.guild)
         await interaction.response.send_message(f"{phrase} {user.mention}")
 
+    @app_commands.command(name="bot-stats")
+    async def stats(self, interaction: discord.Interaction) -> None:
+        """Show statistics of the Gemini requests and outbound HTTP calls."""
+        governor = gemini_client.governor.stats
+        cache = "\n".join(
+            f"{template}: {gemini_client.cache_hits[template]} hits, {gemini_client.cache_misses[template]} misses"
+            for template in sorted(gemini_client.cache_hits.keys() | gemini_client.cache_misses.keys())
+        )
+        hosts = sorted(http_client.stats.items(), key=lambda item: item[1].requests, reverse=True)
+        embed = discord.Embed(title="Bot stats", color=discord.Color.blurple())
+        embed.add_field(
+            name="Gemini requests",
+            value=(
+                f"Requests: {governor.requests}, queued: {governor.queued} "
+                f"(deepest queue: {governor.max_queue_depth})\n"
+                f"Wait for a slot: {governor.average_wait:.2f}s on average, {governor.max_wait:.2f}s at most"
+            ),
+            inline=False,
+        )
+        embed.add_field(name="Gemini response cache", value=cache or "No prompts yet", inline=False)
+        embed.add_field(
+            name="HTTP hosts",
+            value="\n".join(
+                f"{host}: {stats.requests} requests, {stats.errors} errors, "
+                f"{stats.bytes_received / 1024:.0f} KiB, {stats.average_latency * 1000:.0f}ms on average"
+                for host, stats in hosts[:REPORTED_HOSTS]
+            )
+            or "No requests yet",
+            inline=False,
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @commands.Cog.listener()
+    async def on_ready(self) -> None:
+        """Index members again after reconnecting, joins and leaves may have been missed."""
+        member_index.invalidate()
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member) -> None:
+        """Index members that join."""
+        member_index.add(member)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member) -> None:
+        """Drop members that leave."""
+        member_index.remove(member)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, _: discord.Member, after: discord.Member) -> None:
+        """Index members whose join the index missed."""
+        member_index.add(after)
+
 
 async def setup(bot: commands.Bot) -> None:
     """Setups the misc command."""
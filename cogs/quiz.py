@@ -1,21 +1,9 @@
-import asyncio
-import time
-from collections import defaultdict
-
 import discord
 from discord.ext import commands
-from repositories import quiz_repo
+from repositories.quiz_session import quiz_engine
 from utils.database import db
-from utils.quiz import (
-    create_api_call,
-    get_quizzes_with_token,
-    get_sub_topic_id,
-    get_topic_id,
-    has_sub_topic,
-    result_embed,
-)
-
-VOTING_TIME = quiz_repo.voting_time()
+from utils.members import member_resolver
+from utils.sessions import sessions
 
 
 class QuizCommand(commands.Cog):
@@ -34,10 +22,12 @@ class QuizCommand(commands.Cog):
         """Get the score of a user."""
         await interaction.response.defer()
         user = user or interaction.user
-        score = await db.get_score(user.id)
+        member_resolver.remember(user)
+        score = await db.get_score(interaction.guild_id, user.id)
         if score:
+            rank = await db.get_rank(interaction.guild_id, score)
             embed = discord.Embed(
-                description=f"{user.mention}'s Score: {score}",
+                description=f"{user.mention}'s Score: {score} (Rank #{rank})",
                 color=discord.Color.blurple(),
             )
             await interaction.followup.send(
@@ -56,15 +46,44 @@ class QuizCommand(commands.Cog):
                 ephemeral=True,
             )
 
+    @discord.app_commands.command(name="leaderboard")
+    async def leaderboard(self, interaction: discord.Interaction) -> None:
+        """Show the best quiz players of the server."""
+        await interaction.response.defer()
+        top_scores = await db.get_leaderboard(interaction.guild_id)
+        if not top_scores:
+            embed = discord.Embed(
+                description="Nobody has attempted the quiz yet.",
+                color=discord.Color.red(),
+            )
+            await interaction.followup.send(embed=embed)
+            return
+
+        names = await member_resolver.resolve(interaction.guild, [user_id for user_id, _ in top_scores])
+        description = "\n".join(
+            f"{rank}. **{names.get(user_id, f'<@{user_id}>')}** - {score} points"
+            for rank, (user_id, score) in enumerate(top_scores, start=1)
+        )
+        own_score = await db.get_score(interaction.guild_id, interaction.user.id)
+        if own_score:
+            own_rank = await db.get_rank(interaction.guild_id, own_score)
+            description += f"\n\nYour rank: **#{own_rank}** with {own_score} points"
+
+        embed = discord.Embed(
+            title="Leaderboard",
+            description=description,
+            color=discord.Color.blurple(),
+        )
+        await interaction.followup.send(embed=embed)
+
     @discord.app_commands.command(name="quiz")
     async def quiz(self, interaction: discord.Interaction) -> None:
         """Start new quiz."""
         await interaction.response.defer()
         channel_id = interaction.channel_id
-        server_id = interaction.guild_id
 
-        # Check if there's already an active quiz in this channel
-        if await db.command_is_active("quiz", channel_id):
+        # Take the channel, unless there's already an active quiz in it
+        if not (lease := await sessions.acquire("quiz", channel_id)):
             embed = discord.Embed(
                 title="Quiz",
                 description="**A quiz is already running in this channel.**",
@@ -76,88 +95,35 @@ class QuizCommand(commands.Cog):
             )
             return
 
-        # Mark quiz started
-        await db.set_command_active("quiz", channel_id)
-
-        # Voting phase =====================================================================
-        voting_view = quiz_repo.VotingView()
-        await interaction.followup.send(
-            f"Choose your topic! Ends **<t:{int(time.time()) + 11}:R>**",
-            view=voting_view,
-        )
-        voting_view.message = await interaction.original_response()  # Store the original message in the view
-
-        await asyncio.sleep(VOTING_TIME)
-        if timeout := await voting_view.on_timeout():
-            number, topic = timeout
-
-        # Quiz is cancelled
-        else:
+        # Hand the quiz over to the session engine
+        if not await quiz_engine.start(interaction, lease):
+            await sessions.release(lease)
             embed = discord.Embed(
-                title="Quiz is cancelled.",
+                title="Quiz",
+                description="**Too many quizzes are running right now, please try again later.**",
                 color=discord.Color.red(),
             )
-            await interaction.edit_original_response(
-                content=None,
+            await interaction.followup.send(
                 embed=embed,
-                view=None,
+                ephemeral=True,
             )
-            await db.set_command_inactive("quiz", channel_id)
-            return
-
-        # For dynamic topic
-        if has_sub := has_sub_topic(topic):
-            topic_id_correct_count = defaultdict(int)
-
-        # Question phase ====================================================================
-        participants = defaultdict(int)
-        for i in range(1, number + 1):
-            async with interaction.channel.typing():
-                # Get topic id dynamically based on previous answers
-                topic_id = get_sub_topic_id(topic, topic_id_correct_count) if has_sub else get_topic_id(topic)
 
-                # Fetch question
-                quiz = await get_quizzes_with_token(
-                    server_id,
-                    create_api_call(1, topic_id),
-                )
-                quiz = quiz[0]
-
-                # Send the question and store in view
-                content = f"### {i}) {quiz['question']} {'Quiz ends' if i == number else 'Next'} **<t:{int(time.time()) + 11}:R>**"  # noqa: E501
-                question_view = quiz_repo.QuestionView(
-                    i,
-                    quiz["question"],
-                    quiz["correct_answer"],
-                    quiz["incorrect_answers"],
-                    quiz["type"],
-                )
-                question_view.message = await interaction.channel.send(
-                    content=content,
-                    view=question_view,
-                    silent=True,
-                )
-
-            # Set timer
-            await asyncio.sleep(VOTING_TIME)
-            correct_users = await question_view.on_timeout()
-
-            # Track correct answers
-            for user_id in correct_users:
-                participants[user_id] += 1
-                score = await db.get_score(user_id)
-                await db.set_score(user_id, score + 1)
-
-                # Register topic_id is correctly answered (for dynamic topic)
-                if has_sub:
-                    topic_id_correct_count[topic_id] += 1
-
-        # Results =============================================================================
-        embed = await result_embed(interaction, participants)
-        await interaction.channel.send(content="## Quiz ended", embed=embed)
-
-        # Mark quiz ended
-        await db.set_command_inactive("quiz", channel_id)
+    @discord.app_commands.command(name="quiz-stats")
+    async def quiz_stats(self, interaction: discord.Interaction) -> None:
+        """Show statistics of the quiz engine."""
+        stats = quiz_engine.stats
+        embed = discord.Embed(
+            title="Quiz stats",
+            description=(
+                f"Running quizzes: **{quiz_engine.active}**\n"
+                f"Started: {stats.started}, finished: {stats.finished}, cancelled: {stats.cancelled}, "
+                f"rejected: {stats.rejected}\n"
+                f"Rounds: {stats.rounds} ({stats.early_rounds} closed early), "
+                f"average length: {stats.average_round_time:.1f}s"
+            ),
+            color=discord.Color.blurple(),
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
 
 
 async def setup(bot: commands.Bot) -> None:
@@ -1,3 +1,5 @@
+import argparse
+import asyncio
 import logging.config
 import os
 from pathlib import Path
@@ -7,6 +9,9 @@ from cogwatch import watch
 from discord.ext import commands
 from dotenv import load_dotenv
 from utils.database import db
+from utils.http import http_client
+from utils.startup import startup_profiler
+from utils.warmer import warmer
 
 load_dotenv()
 
@@ -17,10 +22,6 @@ MY_GUILD = discord.Object(id=server)
 intents = discord.Intents.all()
 allowed_installs = discord.app_commands.AppInstallationType(guild=True)
 
-if not Path.exists(Path("logs")):
-    Path.mkdir(Path("logs"))
-
-logging.config.fileConfig("logging.conf")
 logger = logging.getLogger("bot")
 
 
@@ -35,8 +36,13 @@ class InfoFilter(logging.Filter):
         return True
 
 
-cogwatcher = logging.getLogger("cogwatch")
-cogwatcher.addFilter(InfoFilter())
+def configure_logging() -> None:
+    """Create the logs directory and apply the logging config."""
+    Path("logs").mkdir(exist_ok=True)
+    # Module loggers already exist by now, so keep them enabled
+    logging.config.fileConfig("logging.conf", disable_existing_loggers=False)
+    cogwatcher = logging.getLogger("cogwatch")
+    cogwatcher.addFilter(InfoFilter())
 
 
 class Bot(commands.Bot):
@@ -54,26 +60,55 @@ class Bot(commands.Bot):
 
     async def setup_hook(self) -> None:
         """Setups hook for the bot."""
+        with startup_profiler.phase("http session"):
+            await http_client.start()
+        await asyncio.gather(self.create_indexes(), self.load_extensions())
+        warmer.start()
         # This copies the global commands over to your guild.
-        await self.load_extensions()
         self.tree._guild_commands[MY_GUILD.id] = self.tree._global_commands
         self.tree._global_commands = {}
-        await self.tree.sync(guild=MY_GUILD)
+        with startup_profiler.phase("command sync"):
+            await self.tree.sync(guild=MY_GUILD)
+
+    async def create_indexes(self) -> None:
+        """Create the database indexes."""
+        with startup_profiler.phase("database indexes"):
+            await db.create_indexes()
+
+    async def close(self) -> None:
+        """Close the bot and its outbound connections."""
+        await warmer.close()
+        await super().close()
+        await http_client.close()
+        await db.close()
 
     @watch(path="cogs", default_logger=False)
     async def on_ready(self) -> None:
         """Call when bot is logged in."""
-        await db.clear_command_cache()
         await bot.change_presence(activity=discord.Game(name="/help"))
         logger.info("Logged in as %s (ID: %s)", bot.user, bot.user.id)
+        if startup_profiler.enabled:
+            startup_profiler.mark("gateway ready")
+            logger.info(startup_profiler.report())
+            await self.close()
 
     async def load_extensions(self) -> None:
-        """Load all extensions in the cogs directory."""
+        """Load all extensions in the cogs directory at once."""
         extension_path = "cogs"
-        for filename in os.listdir(extension_path):
-            if filename.endswith(".py") and filename != "__init__.py":
-                await bot.load_extension(f"{extension_path}.{filename[:-3]}")
-                logger.info("extension %s loaded.", filename)
+        with startup_profiler.phase("extensions"):
+            await asyncio.gather(
+                *(
+                    self.load_cog(f"{extension_path}.{filename[:-3]}")
+                    for filename in os.listdir(extension_path)
+                    if filename.endswith(".py") and filename != "__init__.py"
+                ),
+            )
+
+    async def load_cog(self, name: str) -> None:
+        """Load one extension."""
+        with startup_profiler.phase(f"extension {name}"):
+            await self.load_extension(name)
+        logger.info("extension %s loaded.", name)
 
 
 bot = Bot()
@@ -104,6 +139,17 @@ async def help(interaction: discord.Interaction) -> None:
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="report the time spent per import and setup phase, then exit once connected",
+    )
+    args = parser.parse_args()
+    if args.profile_startup:
+        startup_profiler.start("main")
+    with startup_profiler.phase("logging"):
+        configure_logging()
     try:
         bot.run(BOT_TOKEN)
     except KeyboardInterrupt:
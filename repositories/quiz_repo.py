@@ -1,8 +1,12 @@
+import asyncio
 import random
+from collections.abc import Callable
 
 import discord
 from discord.ui import Button, View
-from utils.quiz import fetch_categories, learn_more_url
+from utils.edits import EditCoalescer
+from utils.quiz import DEFAULT_LINK, catalogue, learn_more_url
+from utils.warmer import QUIZ, topic_usage
 
 VOTING_TIME = 10
 
@@ -13,7 +17,8 @@ class VotingView(View):
     def __init__(self) -> None:
         super().__init__(timeout=None)
         self.user_votes = {}
-        self.topic_ids = fetch_categories()
+        self.edits = EditCoalescer(self)
+        self.topic_ids = catalogue.topics
 
         for topic in [*random.sample(list(self.topic_ids.keys()), 3), "Random"]:
             self.add_item(TopicButton(label=topic, value=topic, voting_view=self, row=0))
@@ -41,6 +46,9 @@ class VotingView(View):
                     child.style = discord.ButtonStyle.success
                 child.disabled = True
 
+        # The final edit below replaces any pending vote count update
+        self.edits.cancel()
+
         # Separate TopicButton and NumQuestionButton and CancelButton
         topic_buttons = [child for child in self.children if isinstance(child, TopicButton)]
         question_buttons = [child for child in self.children if isinstance(child, NumQuestionButton)]
@@ -58,6 +66,8 @@ class VotingView(View):
             selected_topic = most_vote_topic
 
         selected_number = determine_winner(question_buttons)
+        if most_vote_topic != "Random":
+            topic_usage.record(self.message.guild and self.message.guild.id, QUIZ, selected_topic)
 
         # Update final buttons
         update_button(topic_buttons, most_vote_topic)
@@ -112,8 +122,9 @@ class BaseVotingButton(Button):
         self.votes += 1
         self.label = f"{self.label_text} ({self.votes})"
 
-        # Update the view
-        await interaction.response.edit_message(view=self.voting_view)
+        # Acknowledge now, update the vote counts with the next coalesced edit
+        await interaction.response.defer()
+        self.voting_view.edits.request(interaction.message)
 
 
 class TopicButton(BaseVotingButton):
@@ -139,14 +150,23 @@ class NumQuestionButton(BaseVotingButton):
 class QuestionView(View):
     """Each question in the quiz."""
 
-    def __init__(self, i: int, question: str, correct: str, incorrects: list, type: str) -> None:
+    def __init__(
+        self,
+        i: int,
+        question: str,
+        correct: str,
+        incorrects: list,
+        type: str,
+        on_answer: Callable[[int], None] | None = None,
+    ) -> None:
         super().__init__(timeout=None)
         self.user_answers = {}
+        self.on_answer = on_answer
         self.i = i
         self.question = question
         self.correct = correct
         self.incorrects = incorrects
-        self.url = learn_more_url(self.question)
+        self.url_task: asyncio.Task | None = None
 
         if type == "multiple":
             answers = [*incorrects, correct]
@@ -157,6 +177,10 @@ class QuestionView(View):
         for answer in answers:
             self.add_item(AnswerButton(label=answer, question_view=self))
 
+    def resolve_url(self) -> None:
+        """Start looking up the learn more link in the background."""
+        self.url_task = asyncio.create_task(learn_more_url(self.question))
+
     async def on_timeout(self) -> list:
         """After timeout, highlight correct answer."""
         # Highlight correct answer, disable all buttons
@@ -166,7 +190,8 @@ class QuestionView(View):
             child.disabled = True
 
         # Add Learn More button
-        self.add_item(LearnMoreButton(url=self.url))
+        url = await self.url_task if self.url_task else DEFAULT_LINK
+        self.add_item(LearnMoreButton(url=url))
 
         try:
             await self.message.edit(content=f"### {self.i}) {self.question}", view=self)
@@ -188,7 +213,10 @@ class AnswerButton(Button):
         """Register user's answer."""
         user_id = interaction.user.id
         self.question_view.user_answers[user_id] = self.label
-        await interaction.response.edit_message(view=self.question_view)
+        # Answers are not shown until the reveal, so there is nothing to edit
+        await interaction.response.defer()
+        if self.question_view.on_answer:
+            self.question_view.on_answer(user_id)
 
 
 class LearnMoreButton(Button):
@@ -223,8 +251,9 @@ class CancelButton(Button):
         # Determine cancel state
         self.is_cancelled = False if self.votes == 0 else self.votes > len(self.voting_view.user_votes) / 2
 
-        # Update the view
-        await interaction.response.edit_message(view=self.voting_view)
+        # Acknowledge now, update the vote counts with the next coalesced edit
+        await interaction.response.defer()
+        self.voting_view.edits.request(interaction.message)
 
 
 def voting_time() -> int:
@@ -0,0 +1,301 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from collections import defaultdict
+from collections.abc import Callable, Coroutine
+from dataclasses import dataclass
+from enum import Enum, auto
+
+import discord
+from utils.database import db
+from utils.quiz import QuestionPrefetcher, get_sub_topic_id, get_topic_id, has_sub_topic, result_embed
+from utils.scheduler import Timer, scheduler
+from utils.sessions import LEASE_TTL, Lease, sessions
+
+from repositories.quiz_repo import QuestionView, VotingView, voting_time
+
+logger = logging.getLogger("quiz_session")
+
+VOTING_TIME = voting_time()
+# Quizzes allowed to run at once, further /quiz calls wait for a free slot
+MAX_SESSIONS = int(os.getenv("QUIZ_MAX_SESSIONS", "50"))
+# Seconds a /quiz call waits for a free slot before giving up
+QUEUE_TIMEOUT = 15
+# Seconds a round stays open once every participant has answered
+EARLY_CLOSE_DELAY = 1
+# Seconds between lease renewals, well inside the lease ttl so a slow question fetch cannot outlive it
+LEASE_RENEW_INTERVAL = LEASE_TTL / 3
+
+
+class SessionState(Enum):
+    """Phases of a quiz session."""
+
+    VOTING = auto()
+    ASKING = auto()
+    ANSWERING = auto()
+    FINISHED = auto()
+
+
+@dataclass
+class EngineStats:
+    """Counters of the quiz engine."""
+
+    started: int = 0
+    finished: int = 0
+    cancelled: int = 0
+    rejected: int = 0
+    rounds: int = 0
+    early_rounds: int = 0
+    round_time: float = 0.0
+
+    @property
+    def average_round_time(self) -> float:
+        """Average duration of a round in seconds."""
+        return self.round_time / self.rounds if self.rounds else 0.0
+
+
+class QuizSession:
+    """A quiz in one channel, moved from state to state by scheduler events."""
+
+    def __init__(self, engine: "QuizEngine", interaction: discord.Interaction, lease: Lease) -> None:
+        self.engine = engine
+        self.interaction = interaction
+        self.channel = interaction.channel
+        self.server_id = interaction.guild_id
+        self.lease = lease
+        self.state = SessionState.VOTING
+
+        self.voting_view: VotingView | None = None
+        self.question_view: QuestionView | None = None
+        self.prefetcher: QuestionPrefetcher | None = None
+        self.timer: Timer | None = None
+        self.renewal: Timer | None = None
+
+        self.number = 0
+        self.topic = ""
+        self.round = 0
+        self.round_started = 0.0
+        self.closing_early = False
+        self.topic_id = None
+        self.has_sub = False
+        self.topic_id_correct_count = defaultdict(int)
+        self.players: set[int] = set()
+        self.scores = defaultdict(int)
+
+    def schedule(self, delay: float, step: Callable[[], Coroutine]) -> None:
+        """Run a step of this session after `delay` seconds."""
+        self.timer = scheduler.schedule(delay, lambda: self.engine.run_step(self, step))
+
+    async def keep_lease(self) -> None:
+        """Renew the lease and schedule the next renewal, for as long as the session lives."""
+        if self.state is SessionState.FINISHED:
+            return
+        self.renewal = scheduler.schedule(LEASE_RENEW_INTERVAL, self.keep_lease)
+        await sessions.renew(self.lease)
+
+    # Voting phase =========================================================================
+    async def start(self) -> None:
+        """Post the voting message."""
+        self.voting_view = VotingView()
+        await self.interaction.followup.send(
+            f"Choose your topic! Ends **<t:{int(time.time()) + 11}:R>**",
+            view=self.voting_view,
+        )
+        self.voting_view.message = await self.interaction.original_response()
+        self.schedule(VOTING_TIME, self.close_voting)
+        self.renewal = scheduler.schedule(LEASE_RENEW_INTERVAL, self.keep_lease)
+
+    async def close_voting(self) -> None:
+        """Settle the vote and start the first round, or cancel the quiz."""
+        if not (result := await self.voting_view.on_timeout()):
+            embed = discord.Embed(
+                title="Quiz is cancelled.",
+                color=discord.Color.red(),
+            )
+            await self.interaction.edit_original_response(content=None, embed=embed, view=None)
+            await self.finish(cancelled=True)
+            return
+
+        self.number, self.topic = result
+        self.has_sub = has_sub_topic(self.topic)
+        self.players.update(self.voting_view.user_votes)
+
+        # Start fetching questions ahead of the rounds
+        self.prefetcher = QuestionPrefetcher(self.server_id, self.topic, self.number)
+        self.prefetcher.fill()
+        await self.ask()
+
+    # Question phase =======================================================================
+    async def ask(self) -> None:
+        """Post the next question and start its timer."""
+        self.state = SessionState.ASKING
+        self.round += 1
+        self.closing_early = False
+
+        async with self.channel.typing():
+            # Get topic id dynamically based on previous answers
+            self.topic_id = (
+                get_sub_topic_id(self.topic, self.topic_id_correct_count) if self.has_sub else get_topic_id(self.topic)
+            )
+            quiz = await self.prefetcher.get(self.topic_id)
+
+            i = self.round
+            content = f"### {i}) {quiz['question']} {'Quiz ends' if i == self.number else 'Next'} **<t:{int(time.time()) + 11}:R>**"  # noqa: E501
+            self.question_view = QuestionView(
+                i,
+                quiz["question"],
+                quiz["correct_answer"],
+                quiz["incorrect_answers"],
+                quiz["type"],
+                on_answer=self.on_answer,
+            )
+            self.question_view.message = await self.channel.send(
+                content=content,
+                view=self.question_view,
+                silent=True,
+            )
+            self.question_view.resolve_url()
+
+        self.state = SessionState.ANSWERING
+        self.round_started = time.monotonic()
+        self.schedule(VOTING_TIME, self.close_round)
+
+    def on_answer(self, user_id: int) -> None:
+        """Close the round early once every participant has answered."""
+        self.players.add(user_id)
+        if self.state is not SessionState.ANSWERING or self.closing_early:
+            return
+        if self.players <= self.question_view.user_answers.keys():
+            self.closing_early = True
+            self.timer.cancel()
+            self.schedule(EARLY_CLOSE_DELAY, self.close_round)
+
+    async def close_round(self) -> None:
+        """Reveal the answer, score the round and move on."""
+        if self.state is not SessionState.ANSWERING:
+            return
+        self.state = SessionState.ASKING
+        self.engine.record_round(time.monotonic() - self.round_started, early=self.closing_early)
+
+        correct_users = await self.question_view.on_timeout()
+
+        # Track correct answers
+        for user_id in correct_users:
+            self.scores[user_id] += 1
+
+            # Register topic_id is correctly answered (for dynamic topic)
+            if self.has_sub:
+                self.topic_id_correct_count[self.topic_id] += 1
+        await db.increment_scores(self.server_id, dict.fromkeys(correct_users, 1))
+
+        if self.round < self.number:
+            await self.ask()
+        else:
+            await self.show_results()
+
+    # Results ==============================================================================
+    async def show_results(self) -> None:
+        """Post the podium and end the session."""
+        embed = await result_embed(self.interaction, self.scores)
+        await self.channel.send(content="## Quiz ended", embed=embed)
+        await self.finish()
+
+    async def abort(self) -> None:
+        """Close the open view and tell the channel the quiz stopped."""
+        for view in (self.voting_view, self.question_view):
+            if view is None or all(getattr(child, "disabled", True) for child in view.children):
+                continue
+            if isinstance(view, VotingView):
+                view.edits.cancel()
+            for child in view.children:
+                child.disabled = True
+            view.stop()
+            if message := getattr(view, "message", None):
+                with contextlib.suppress(discord.HTTPException):
+                    await message.edit(view=view)
+
+        embed = discord.Embed(
+            title="Quiz stopped because of an error.",
+            color=discord.Color.red(),
+        )
+        with contextlib.suppress(discord.HTTPException):
+            await self.channel.send(embed=embed)
+
+    async def finish(self, *, cancelled: bool = False) -> None:
+        """Release everything the session holds."""
+        if self.state is SessionState.FINISHED:
+            return
+        self.state = SessionState.FINISHED
+        if self.timer:
+            self.timer.cancel()
+        if self.renewal:
+            self.renewal.cancel()
+        if self.prefetcher:
+            self.prefetcher.close()
+        await sessions.release(self.lease)
+        self.engine.remove(self, cancelled=cancelled)
+
+
+class QuizEngine:
+    """Runs every quiz session on the shared scheduler, with a cap on concurrent sessions."""
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS) -> None:
+        self.max_sessions = max_sessions
+        self.sessions: set[QuizSession] = set()
+        self.stats = EngineStats()
+        self._slots = asyncio.Semaphore(max_sessions)
+
+    @property
+    def active(self) -> int:
+        """Number of running sessions."""
+        return len(self.sessions)
+
+    async def start(self, interaction: discord.Interaction, lease: Lease) -> bool:
+        """Start a session once a slot is free. Return False if none freed up in time."""
+        try:
+            await asyncio.wait_for(self._slots.acquire(), QUEUE_TIMEOUT)
+        except TimeoutError:
+            self.stats.rejected += 1
+            return False
+
+        session = QuizSession(self, interaction, lease)
+        self.sessions.add(session)
+        self.stats.started += 1
+        await self.run_step(session, session.start)
+        return True
+
+    async def run_step(self, session: QuizSession, step: Callable[[], Coroutine]) -> None:
+        """Run one transition of a session, ending the session if it fails."""
+        if session.state is SessionState.FINISHED:
+            return
+        try:
+            await step()
+        except Exception:
+            logger.exception("Quiz session in channel %s failed.", session.channel.id)
+            try:
+                await session.abort()
+            finally:
+                await session.finish(cancelled=True)
+
+    def record_round(self, duration: float, *, early: bool) -> None:
+        """Count a finished round."""
+        self.stats.rounds += 1
+        self.stats.round_time += duration
+        if early:
+            self.stats.early_rounds += 1
+
+    def remove(self, session: QuizSession, *, cancelled: bool) -> None:
+        """Forget a finished session and free its slot."""
+        if session not in self.sessions:
+            return
+        self.sessions.discard(session)
+        self._slots.release()
+        if cancelled:
+            self.stats.cancelled += 1
+        else:
+            self.stats.finished += 1
+
+
+quiz_engine = QuizEngine()
@@ -0,0 +1,43 @@
+"""Compare the speed of the sentence splitter with the original one.
+
+Run with `python -m tests.bench_sentences` from the repository root.
+"""
+
+import random
+import timeit
+
+from utils.wiki import Sentences, split_into_sentences
+
+from tests.sentence_corpus import legacy_split_into_sentences, make_corpus
+
+# Texts per corpus, and how many times each corpus is split
+CORPUS_SIZE = 2000
+REPEAT = 5
+
+
+def bench(name: str, texts: list[str]) -> None:
+    """Print the best time of each splitter over the texts."""
+    splittable = [text for text in texts if len(legacy_split_into_sentences(text)) >= 2]  # noqa: PLR2004
+    timings = {
+        "legacy": lambda: [legacy_split_into_sentences(text) for text in texts],
+        "split_into_sentences": lambda: [split_into_sentences(text) for text in texts],
+        "Sentences.sample(2)": lambda: [Sentences(text).sample(2) for text in splittable],
+    }
+    baseline = None
+    for label, run in timings.items():
+        best = min(timeit.repeat(run, number=1, repeat=REPEAT))
+        baseline = baseline or best
+        print(f"{name:>8} {label:<22} {best * 1000:9.1f} ms  {baseline / best:5.2f}x")
+
+
+def main() -> None:
+    """Benchmark short fuzzed texts and long article-like texts."""
+    short = make_corpus(CORPUS_SIZE)
+    rng = random.Random(1)
+    articles = [" ".join(rng.sample(short, 50)) for _ in range(CORPUS_SIZE // 10)]
+    bench("short", short)
+    bench("articles", articles)
+
+
+if __name__ == "__main__":
+    main()
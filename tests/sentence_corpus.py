@@ -0,0 +1,101 @@
+"""Frozen copy of the original sentence splitter and a corpus of texts to compare against it."""
+
+import random
+import re
+
+# Credits to https://stackoverflow.com/questions/4576077/how-can-i-split-a-text-into-sentences
+alphabets = "([A-Za-z])"
+prefixes = "(Mr|St|Mrs|Ms|Dr)[.]"
+suffixes = "(Inc|Ltd|Jr|Sr|Co)"
+starters = (
+    r"(Mr|Mrs|Ms|Dr|Prof|Capt|Cpt|Lt|He\s|She\s|It\s|They\s|Their\s|Our\s|We\s|But\s|However\s|That\s|This\s|Wherever)"
+)
+acronyms = "([A-Z][.][A-Z][.](?:[A-Z][.])?)"
+websites = "[.](com|net|org|io|gov|edu|me)"
+digits = "([0-9])"
+multiple_dots = r"\.{2,}"
+
+# Pieces the corpus texts are made of, chosen to hit every rule of the splitter
+TOKENS = [
+    *"the cat sat on mat river city war king was born in".split(),
+    *"Mr. Mrs. Ms. Dr. St. Prof. Capt. Lt. Ph.D. U.S. U.S.A. e.g. i.e. A. b. Z.".split(),
+    *"Inc. Ltd. Jr. Sr. Co. Inc Co".split(),
+    *"He She It They Their Our We But However That This Wherever".split(),
+    *"3.14 1.5 10. 2 example.com site.org x.io gov.gov edu.edu me.me".split(),
+    ".",
+    ".",
+    ".",
+    "..",
+    "...",
+    "....",
+    "!",
+    "?",
+    "!?",
+    '"',
+    '."',
+    '!"',
+    '?"',
+    "”",
+    ".”",
+    "\n",
+    "\n\n",
+    "(",
+    ")",
+    ",",
+    ";",
+    "-",
+    "A",
+    "I",
+    "é",
+    "Ω",
+]
+
+
+def legacy_split_into_sentences(text: str) -> list[str]:
+    """Split the text into sentences, exactly as the splitter did before it was precompiled."""
+    text = " " + text + "  "
+    text = text.replace("\n", " ")
+    text = re.sub(prefixes, "\\1<prd>", text)
+    text = re.sub(websites, "<prd>\\1", text)
+    text = re.sub(digits + "[.]" + digits, "\\1<prd>\\2", text)
+    text = re.sub(multiple_dots, lambda match: "<prd>" * len(match.group(0)) + "<stop>", text)
+    if "Ph.D" in text:
+        text = text.replace("Ph.D.", "Ph<prd>D<prd>")
+    text = re.sub(r"\s" + alphabets + "[.] ", " \\1<prd> ", text)
+    text = re.sub(acronyms + " " + starters, "\\1<stop> \\2", text)
+    text = re.sub(
+        alphabets + "[.]" + alphabets + "[.]" + alphabets + "[.]",
+        "\\1<prd>\\2<prd>\\3<prd>",
+        text,
+    )
+    text = re.sub(alphabets + "[.]" + alphabets + "[.]", "\\1<prd>\\2<prd>", text)
+    text = re.sub(" " + suffixes + "[.] " + starters, " \\1<stop> \\2", text)
+    text = re.sub(" " + suffixes + "[.]", " \\1<prd>", text)
+    text = re.sub(" " + alphabets + "[.]", " \\1<prd>", text)
+    if "”" in text:
+        text = text.replace(".”", "”.")
+    if '"' in text:
+        text = text.replace('."', '".')
+    if "!" in text:
+        text = text.replace('!"', '"!')
+    if "?" in text:
+        text = text.replace('?"', '"?')
+    text = text.replace(".", ".<stop>")
+    text = text.replace("?", "?<stop>")
+    text = text.replace("!", "!<stop>")
+    text = text.replace("<prd>", ".")
+    sentences = text.split("<stop>")
+    sentences = [s.strip() for s in sentences]
+    if sentences and not sentences[-1]:
+        sentences = sentences[:-1]
+    return sentences
+
+
+def make_corpus(size: int, max_tokens: int = 40, seed: int = 2024) -> list[str]:
+    """Return `size` random texts built from TOKENS, the same ones for the same seed."""
+    rng = random.Random(seed)
+    texts = ["", " ", ".", "...", "No period at all", "Ends with a period."]
+    while len(texts) < size:
+        tokens = rng.choices(TOKENS, k=rng.randint(1, max_tokens))
+        texts.append("".join(token + rng.choice(["", " ", " ", " ", "  "]) for token in tokens))
+    return texts
@@ -0,0 +1,53 @@
+import random
+
+import pytest
+from utils.wiki import Sentences, split_into_sentences
+
+from tests.sentence_corpus import legacy_split_into_sentences, make_corpus
+
+CORPUS = make_corpus(5000)
+
+
+@pytest.fixture(scope="module")
+def expected() -> list[list[str]]:
+    """Sentences of every corpus text, split by the original splitter."""
+    return [legacy_split_into_sentences(text) for text in CORPUS]
+
+
+def test_split_matches_legacy(expected: list[list[str]]) -> None:
+    """Splitting gives the same sentences as before."""
+    for text, sentences in zip(CORPUS, expected, strict=True):
+        assert split_into_sentences(text) == sentences, text
+
+
+def test_indexing_matches_legacy(expected: list[list[str]]) -> None:
+    """Single sentences are copied out with the same text iteration gives."""
+    for text, sentences in zip(CORPUS, expected, strict=True):
+        indexed = Sentences(text)
+        assert len(indexed) == len(sentences), text
+        assert [indexed[i] for i in range(len(indexed))] == sentences, text
+        if sentences:
+            assert indexed[-1] == sentences[-1], text
+
+
+def test_sample_matches_legacy(expected: list[list[str]]) -> None:
+    """Sampled sentences are distinct sentences of the text."""
+    for seed, (text, sentences) in enumerate(zip(CORPUS, expected, strict=True)):
+        if len(sentences) < 2:  # noqa: PLR2004
+            continue
+        random.seed(seed)
+        indices = random.sample(range(len(sentences)), 2)
+        random.seed(seed)
+        assert Sentences(text).sample(2) == [sentences[i] for i in indices], text
+
+
+def test_span_excludes_markers() -> None:
+    """Spans cover the sentence text only."""
+    sentences = Sentences("Hello world. Mr. Smith went to Washington! Did he?")
+    assert [sentences[i] for i in range(len(sentences))] == [
+        "Hello world.",
+        "Mr. Smith went to Washington!",
+        "Did he?",
+    ]
+    start, end = sentences.span(0)
+    assert sentences.text[start:end].strip() == "Hello world."
@@ -0,0 +1,130 @@
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+CACHE_DIR = Path(".cache")
+
+MISSING = object()
+
+
+class TTLCache:
+    """In-memory LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float | None = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Any, tuple[float | None, Any]] = OrderedDict()
+
+    def get(self, key: Any, default: Any = None) -> Any:  # noqa: ANN401
+        """Return the cached value, or `default` if missing or expired."""
+        try:
+            expires_at, value = self._data[key]
+        except KeyError:
+            return default
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Any, value: Any, ttl: float | None = None) -> None:  # noqa: ANN401
+        """Store a value, evicting the least recently used entry if full."""
+        ttl = ttl if ttl is not None else self.ttl
+        self._data[key] = (time.monotonic() + ttl if ttl is not None else None, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Any, default: Any = None) -> Any:  # noqa: ANN401
+        """Remove and return a value."""
+        return self._data.pop(key, (None, default))[1]
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class DiskCache:
+    """Persistent key/value cache backed by SQLite. Values must be JSON serializable."""
+
+    def __init__(self, path: Path, ttl: float | None = None) -> None:
+        self.path = path
+        self.ttl = ttl
+        self._connection: sqlite3.Connection | None = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Return the database connection, opening it on first use."""
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.path)
+            self._connection.executescript(
+                "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;"
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, expires_at REAL, value TEXT NOT NULL);",
+            )
+        return self._connection
+
+    def get(self, key: str, default: Any = None) -> Any:  # noqa: ANN401
+        """Return the stored value, or `default` if missing or expired."""
+        row = self.connection.execute("SELECT expires_at, value FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return default
+        expires_at, value = row
+        if expires_at is not None and expires_at < time.time():
+            self.delete(key)
+            return default
+        return json.loads(value)
+
+    def set(self, key: str, value: Any, ttl: float | None = None) -> None:  # noqa: ANN401
+        """Store a value."""
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self.connection as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO cache (key, expires_at, value) VALUES (?, ?, ?)",
+                (key, expires_at, json.dumps(value)),
+            )
+
+    def delete(self, key: str) -> None:
+        """Remove a value."""
+        with self.connection as connection:
+            connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def close(self) -> None:
+        """Close the database connection."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class TieredCache:
+    """In-memory LRU in front of a disk cache."""
+
+    def __init__(self, path: Path, maxsize: int = 1024, ttl: float | None = None) -> None:
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.disk = DiskCache(path, ttl=ttl)
+
+    def get(self, key: str, default: Any = None) -> Any:  # noqa: ANN401
+        """Return the value from memory, falling back to disk."""
+        if (value := self.memory.get(key, MISSING)) is not MISSING:
+            return value
+        if (value := self.disk.get(key, MISSING)) is not MISSING:
+            self.memory.set(key, value)
+            return value
+        return default
+
+    def set(self, key: str, value: Any, ttl: float | None = None) -> None:  # noqa: ANN401
+        """Store the value in both tiers."""
+        self.memory.set(key, value, ttl)
+        self.disk.set(key, value, ttl)
+
+    def delete(self, key: str) -> None:
+        """Remove the value from both tiers."""
+        self.memory.pop(key)
+        self.disk.delete(key)
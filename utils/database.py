@@ -1,63 +1,319 @@
+import asyncio
+import bisect
 import logging
 import os
+from collections import Counter, defaultdict
+from collections.abc import Iterable
+from datetime import UTC, datetime, timedelta
+from functools import cached_property
 
 import motor.motor_asyncio
+from pymongo import DESCENDING, UpdateOne
+from pymongo.errors import DuplicateKeyError
 
 logger = logging.getLogger("db")
 
+# Seconds score increments are coalesced before being written, 0 writes every round directly
+SCORE_FLUSH_INTERVAL = float(os.getenv("SCORE_FLUSH_INTERVAL", "0"))
+# Number of top scores cached per guild
+LEADERBOARD_SIZE = 25
+
+
+class LeaderboardCache:
+    """Top scores of each guild, kept sorted and updated as scores are written."""
+
+    def __init__(self, size: int = LEADERBOARD_SIZE) -> None:
+        self.size = size
+        self._pages: dict[int, list[tuple[int, int]]] = {}
+
+    def get(self, guild_id: int) -> list[tuple[int, int]] | None:
+        """Return the cached (user id, score) page of the guild, best first."""
+        return self._pages.get(guild_id)
+
+    def set(self, guild_id: int, page: list[tuple[int, int]]) -> None:
+        """Cache a page loaded from the database."""
+        self._pages[guild_id] = page
+
+    def update(self, guild_id: int, scores: dict[int, int]) -> None:
+        """Merge new absolute scores of users into the cached page."""
+        if (page := self._pages.get(guild_id)) is None:
+            return
+        merged = dict(page) | scores
+        self._pages[guild_id] = sorted(merged.items(), key=lambda entry: (-entry[1], entry[0]))[: self.size]
+
+    def invalidate(self, guild_id: int) -> None:
+        """Forget the page of a guild, for writes that can lower a score."""
+        self._pages.pop(guild_id, None)
+
+    def rank(self, guild_id: int, score: int) -> int | None:
+        """Return the rank of a score if the cached page decides it."""
+        page = self._pages.get(guild_id)
+        if page is None or (len(page) == self.size and score < page[-1][1]):
+            return None
+        # Scores are descending, so bisect on their negation
+        return bisect.bisect_left(page, -score, key=lambda entry: -entry[1]) + 1
+
+
+class ScoreBuffer:
+    """Write-behind buffer coalescing score increments over a short window."""
+
+    def __init__(self, database: "Database", interval: float) -> None:
+        self.database = database
+        self.interval = interval
+        self.pending: Counter[tuple[int, int]] = Counter()
+        self.flushing: Counter[tuple[int, int]] = Counter()
+        self._flush_task: asyncio.Task | None = None
+
+    def add(self, increments: dict[tuple[int, int], int]) -> None:
+        """Buffer increments keyed by (guild id, user id) and schedule a flush."""
+        self.pending.update(increments)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def flush(self) -> None:
+        """Write all buffered increments."""
+        increments, self.pending = self.pending, Counter()
+        self.flushing.update(increments)
+        try:
+            await self.database.add_scores(increments)
+        except Exception:
+            # Keep them for the next flush
+            self.pending.update(increments)
+            raise
+        finally:
+            self.flushing.subtract(increments)
+            self.flushing = +self.flushing
+
+    def unwritten(self, guild_id: int, user_id: int) -> int:
+        """Return the increments of a user not yet written to the database."""
+        return self.pending[guild_id, user_id] + self.flushing[guild_id, user_id]
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(self.interval)
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Failed to flush score increments.")
+
+
+class ScoreHistogram:
+    """Background upkeep of the per guild score histograms, off the path of the score writes."""
+
+    def __init__(self, database: "Database") -> None:
+        self.database = database
+        self.dirty: defaultdict[int, set[int]] = defaultdict(set)
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    def mark(self, guild_id: int, user_ids: Iterable[int]) -> None:
+        """Note users whose score changed and bring their guild's histogram up to date soon."""
+        self.dirty[guild_id].update(user_ids)
+        task = self._tasks.get(guild_id)
+        if task is None or task.done():
+            self._tasks[guild_id] = asyncio.create_task(self._sync(guild_id))
+
+    async def wait(self) -> None:
+        """Wait until the histograms caught up with the scores written so far."""
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def _sync(self, guild_id: int) -> None:
+        # One task per guild, so the syncs of a guild never overlap
+        while user_ids := self.dirty.pop(guild_id, None):
+            try:
+                await self.database.count_scores(guild_id, user_ids)
+            except Exception:
+                # Keep them for the next sync of the guild
+                self.dirty[guild_id].update(user_ids)
+                logger.exception("Failed to update the score histogram of guild %s.", guild_id)
+                return
+
 
 class Database:
     """Database class."""
 
     def __init__(self, database: str) -> None:
-        """Form Database Connection."""
-        self.client = motor.motor_asyncio.AsyncIOMotorClient(database)
-        self.db = self.client["bot-data"]
-        self.scores = self.db["scores"]
-        self.commands_cache = self.db["commands_cache"]
-        self.quiz_tokens = self.db["quiz_tokens"]
+        """Prepare the database. The connection is made on first use."""
+        self.database = database
+        self.score_buffer = ScoreBuffer(self, SCORE_FLUSH_INTERVAL) if SCORE_FLUSH_INTERVAL > 0 else None
+        self.leaderboards = LeaderboardCache()
+        self.histogram = ScoreHistogram(self)
 
+    @cached_property
+    def client(self) -> motor.motor_asyncio.AsyncIOMotorClient:
+        """Return the Mongo client, creating it on first use."""
+        # Creating the client resolves mongodb+srv hosts, which blocks
+        client = motor.motor_asyncio.AsyncIOMotorClient(self.database)
         logger.info("Connected to MongoDB database.")
+        return client
+
+    @cached_property
+    def db(self) -> motor.motor_asyncio.AsyncIOMotorDatabase:
+        """Return the bot database."""
+        return self.client["bot-data"]
+
+    @cached_property
+    def scores(self) -> motor.motor_asyncio.AsyncIOMotorCollection:
+        """Return the scores collection."""
+        return self.db["scores"]
+
+    @cached_property
+    def score_counts(self) -> motor.motor_asyncio.AsyncIOMotorCollection:
+        """Return the per guild histogram of scores, for ranking without counting users."""
+        return self.db["score_counts"]
+
+    @cached_property
+    def leases(self) -> motor.motor_asyncio.AsyncIOMotorCollection:
+        """Return the command leases collection."""
+        return self.db["command_leases"]
+
+    @cached_property
+    def quiz_tokens(self) -> motor.motor_asyncio.AsyncIOMotorCollection:
+        """Return the quiz session tokens collection."""
+        return self.db["quiz_tokens"]
+
+    @cached_property
+    def stored_channels(self) -> motor.motor_asyncio.AsyncIOMotorCollection:
+        """Return the collection of channels opted in to the message store."""
+        return self.db["stored_channels"]
+
+    async def create_indexes(self) -> None:
+        """Create the indexes the queries rely on."""
+        # Mongo deletes expired leases by itself
+        await self.leases.create_index("expires_at", expireAfterSeconds=0)
+        # Scores from before they were kept per guild all belong to the bot's guild
+        if server := os.getenv("SERVER"):
+            await self.scores.update_many({"guild_id": {"$exists": False}}, {"$set": {"guild_id": int(server)}})
+        await self.scores.create_index([("guild_id", 1), ("user_id", 1)], unique=True)
+        await self.scores.create_index([("guild_id", 1), ("score", DESCENDING)])
+        await self.score_counts.create_index([("guild_id", 1), ("score", 1)], unique=True)
+
+        # Build the histograms from the existing scores once, `counted` being the score a user is counted at
+        if not await self.score_counts.estimated_document_count():
+            await self.scores.update_many({}, [{"$set": {"counted": "$score"}}])
+            pipeline = [{"$group": {"_id": {"guild_id": "$guild_id", "score": "$counted"}, "count": {"$sum": 1}}}]
+            counts = Counter(
+                {
+                    (doc["_id"]["guild_id"], doc["_id"]["score"]): doc["count"]
+                    async for doc in self.scores.aggregate(pipeline)
+                },
+            )
+            await self._update_score_counts(counts)
 
-    async def get_score(self, user_id: int) -> int:
-        """Get the score of a user."""
-        score = await self.scores.find_one({"user_id": user_id})
-        return score["score"] if score else 0
+    async def get_score(self, guild_id: int, user_id: int) -> int:
+        """Get the score of a user in a guild."""
+        score = await self.scores.find_one({"guild_id": guild_id, "user_id": user_id})
+        pending = self.score_buffer.unwritten(guild_id, user_id) if self.score_buffer else 0
+        return (score["score"] if score else 0) + pending
 
-    async def set_score(self, user_id: int, score: int) -> None:
-        """Set the score of a user."""
+    async def set_score(self, guild_id: int, user_id: int, score: int) -> None:
+        """Set the score of a user in a guild."""
         await self.scores.update_one(
-            {"user_id": user_id},
+            {"guild_id": guild_id, "user_id": user_id},
             {"$set": {"score": score}},
             upsert=True,
         )
+        self.leaderboards.invalidate(guild_id)
+        self.histogram.mark(guild_id, [user_id])
 
-    async def command_is_active(self, command_name: str, channel_id: int) -> bool:
-        """Check if a command is active."""
-        command = await self.commands_cache.find_one(
-            {"command_name": command_name, "channel_id": channel_id},
+    async def add_scores(self, increments: dict[tuple[int, int], int]) -> None:
+        """Increment scores keyed by (guild id, user id) with a single unordered bulk upsert."""
+        if not increments:
+            return
+        await self.scores.bulk_write(
+            [
+                UpdateOne({"guild_id": guild_id, "user_id": user_id}, {"$inc": {"score": amount}}, upsert=True)
+                for (guild_id, user_id), amount in increments.items()
+            ],
+            ordered=False,
         )
-        return command["active"] if command else False
 
-    async def set_command_active(self, command_name: str, channel_id: int) -> None:
-        """Set a command as active."""
-        await self.commands_cache.update_one(
-            {"command_name": command_name, "channel_id": channel_id},
-            {"$set": {"active": True}},
-            upsert=True,
+        by_guild = defaultdict(list)
+        for guild_id, user_id in increments:
+            by_guild[guild_id].append(user_id)
+        for guild_id, user_ids in by_guild.items():
+            self.histogram.mark(guild_id, user_ids)
+
+    async def count_scores(self, guild_id: int, user_ids: Iterable[int]) -> None:
+        """Move users from the score they are counted at to their current one, in the histogram and leaderboard."""
+        # Swapping `counted` atomically applies every change of a score to the histogram exactly once
+        docs = await asyncio.gather(
+            *(
+                self.scores.find_one_and_update(
+                    {"guild_id": guild_id, "user_id": user_id},
+                    [{"$set": {"counted": "$score"}}],
+                    projection={"user_id": True, "score": True, "counted": True},
+                )
+                for user_id in user_ids
+            ),
         )
+        docs = [doc for doc in docs if doc]
+        counts = Counter((guild_id, doc["score"]) for doc in docs)
+        counts.subtract((guild_id, doc["counted"]) for doc in docs if "counted" in doc)
+        await self._update_score_counts(counts)
+        self.leaderboards.update(guild_id, {doc["user_id"]: doc["score"] for doc in docs})
 
-    async def set_command_inactive(self, command_name: str, channel_id: int) -> None:
-        """Set a command as inactive."""
-        await self.commands_cache.update_one(
-            {"command_name": command_name, "channel_id": channel_id},
-            {"$set": {"active": False}},
-            upsert=True,
+    async def _update_score_counts(self, counts: Counter[tuple[int, int]]) -> None:
+        """Apply changes of the number of users per (guild id, score) to the histograms."""
+        updates = [
+            UpdateOne({"guild_id": guild_id, "score": score}, {"$inc": {"count": change}}, upsert=True)
+            for (guild_id, score), change in counts.items()
+            if change
+        ]
+        if updates:
+            await self.score_counts.bulk_write(updates, ordered=False)
+
+    async def increment_scores(self, guild_id: int, increments: dict[int, int]) -> None:
+        """Increment scores of users in a guild, through the write-behind buffer if enabled."""
+        keyed = {(guild_id, user_id): amount for user_id, amount in increments.items()}
+        if self.score_buffer:
+            self.score_buffer.add(keyed)
+        else:
+            await self.add_scores(keyed)
+
+    async def get_leaderboard(self, guild_id: int, limit: int = 10) -> list[tuple[int, int]]:
+        """Return the best (user id, score) pairs of a guild."""
+        if (page := self.leaderboards.get(guild_id)) is None:
+            cursor = self.scores.find({"guild_id": guild_id}).sort("score", DESCENDING).limit(self.leaderboards.size)
+            page = [(doc["user_id"], doc["score"]) async for doc in cursor]
+            self.leaderboards.set(guild_id, page)
+        return page[:limit]
+
+    async def get_rank(self, guild_id: int, score: int) -> int:
+        """Return the rank a score has in a guild."""
+        await self.get_leaderboard(guild_id)
+        if (rank := self.leaderboards.rank(guild_id, score)) is not None:
+            return rank
+        # Summed over the distinct higher scores, however many users hold them
+        pipeline = [
+            {"$match": {"guild_id": guild_id, "score": {"$gt": score}}},
+            {"$group": {"_id": None, "above": {"$sum": "$count"}}},
+        ]
+        result = await self.score_counts.aggregate(pipeline).to_list(1)
+        return (result[0]["above"] if result else 0) + 1
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Atomically take a lease unless another owner holds an unexpired one."""
+        now = datetime.now(UTC)
+        try:
+            await self.leases.update_one(
+                {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lte": now}}]},
+                {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=ttl)}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # The lease exists and the filter did not match it
+            return False
+        return True
+
+    async def renew_lease(self, name: str, owner: str, ttl: float) -> None:
+        """Extend a lease held by the owner."""
+        await self.leases.update_one(
+            {"_id": name, "owner": owner},
+            {"$set": {"expires_at": datetime.now(UTC) + timedelta(seconds=ttl)}},
         )
 
-    async def clear_command_cache(self) -> None:
-        """Clear the command cache."""
-        await self.commands_cache.delete_many({})
+    async def release_lease(self, name: str, owner: str) -> None:
+        """Drop a lease held by the owner."""
+        await self.leases.delete_one({"_id": name, "owner": owner})
 
     async def get_token(self, server_id: int) -> dict:
         """Return all currently tokens."""
@@ -73,9 +329,28 @@ class Database:
             upsert=True,
         )
 
+    async def get_stored_channels(self) -> list[tuple[int, int]]:
+        """Return the (guild id, channel id) of every channel that opted in to the message store."""
+        return [(doc["guild_id"], doc["_id"]) async for doc in self.stored_channels.find()]
+
+    async def set_channel_stored(self, guild_id: int, channel_id: int, *, stored: bool) -> None:
+        """Opt a channel in to or out of the message store."""
+        if stored:
+            await self.stored_channels.update_one(
+                {"_id": channel_id},
+                {"$set": {"guild_id": guild_id}},
+                upsert=True,
+            )
+        else:
+            await self.stored_channels.delete_one({"_id": channel_id})
+
     async def close(self) -> None:
-        """Close the database connection."""
-        self.client.close()
+        """Flush buffered writes and close the database connection."""
+        if self.score_buffer:
+            await self.score_buffer.flush()
+        await self.histogram.wait()
+        if "client" in self.__dict__:
+            self.client.close()
 
 
 db = Database(os.getenv("DATABASE"))
@@ -0,0 +1,51 @@
+import logging
+import os
+import time
+
+import discord
+
+from utils.scheduler import Timer, scheduler
+
+logger = logging.getLogger("edits")
+
+# Minimum seconds between two edits of the same view's message
+EDIT_INTERVAL = float(os.getenv("VIEW_EDIT_INTERVAL", "1.5"))
+
+
+class EditCoalescer:
+    """Re-render a view's message at most once per interval, however many clicks changed it."""
+
+    def __init__(self, view: discord.ui.View, interval: float = EDIT_INTERVAL) -> None:
+        self.view = view
+        self.interval = interval
+        self.message: discord.Message | None = None
+        self._dirty = False
+        self._timer: Timer | None = None
+        self._last_edit = 0.0
+
+    def request(self, message: discord.Message) -> None:
+        """Mark the view as changed. The edit is sent once the interval has passed."""
+        self.message = message
+        self._dirty = True
+        if self._timer is None:
+            delay = self._last_edit + self.interval - time.monotonic()
+            self._timer = scheduler.schedule(max(delay, 0), self.flush)
+
+    async def flush(self) -> None:
+        """Send the pending edit, if any."""
+        self._timer = None
+        if not self._dirty or self.message is None:
+            return
+        self._dirty = False
+        self._last_edit = time.monotonic()
+        try:
+            await self.message.edit(view=self.view)
+        except discord.HTTPException as e:
+            logger.warning("HTTPException while editing message: %s", e)
+
+    def cancel(self) -> None:
+        """Drop the pending edit, for when the view is about to be edited directly."""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        self._dirty = False
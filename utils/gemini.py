@@ -1,14 +1,25 @@
+import asyncio
+import hashlib
 import json
+import logging
 import os
 import traceback
+from collections import Counter
+from collections.abc import AsyncIterator, Iterator
+from typing import TYPE_CHECKING
 
-import google.generativeai as genai
 from dotenv import load_dotenv
-from google.generativeai.types import HarmBlockThreshold, HarmCategory, generation_types
 
-load_dotenv()
+from utils.cache import CACHE_DIR, MISSING, TieredCache
+from utils.throttle import RequestGovernor, SingleFlight
+
+if TYPE_CHECKING:
+    import google.generativeai as genai
+    from google.generativeai.types import generation_types
 
-genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+logger = logging.getLogger("gemini")
+
+load_dotenv()
 
 convo_template = """
 Topic: "{topic}"
@@ -28,21 +39,195 @@ summary_template = """Summarize the conversation below:
 """
 
 
+combine_template = """Combine these summaries of consecutive parts of one conversation
+into one summary of the whole conversation:
+```
+{summaries}
+```
+
+Using this JSON schema:
+    Return {{"summary": str}}
+"""
+
+
+false_facts_template = """
+Create a false fact for a True False quiz based on each of these facts, in one line each. Keep the order of the facts.
+Facts:
+{facts}
+
+Using this JSON schema:
+    Return a `list[str]` of exactly {count} false statements
+"""
+
+
 name_fact = """
 Given a username: {name}. Come up with 1 fun fact about this name. If no fun fact can be made, just say False."""
 
+MODEL_NAME = "gemini-1.5-flash"
+# Seconds a response is reused, per prompt template. Templates without TTL are not cached,
+# like conversations, which should differ every time the same topic is discussed
+CACHE_TTLS = {
+    "summary": 7 * 24 * 60 * 60,
+    "combine": 7 * 24 * 60 * 60,
+    "name_fact": 30 * 24 * 60 * 60,
+    "false_statements": 24 * 60 * 60,
+}
+# Seconds a blocked prompt is answered from the cache
+BLOCKED_TTL = 24 * 60 * 60
+# Requests sent to Gemini at once, and the per minute quota of the API key
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "4"))
+GEMINI_REQUESTS_PER_MINUTE = int(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "15"))
+GEMINI_TOKENS_PER_MINUTE = int(os.getenv("GEMINI_TOKENS_PER_MINUTE", "1000000"))
+# Rough number of characters per token, to estimate prompt sizes
+CHARS_PER_TOKEN = 4
+# Queue priority per prompt template, lower goes first: short interactive prompts before summaries
+PRIORITIES = {
+    "name_fact": 0,
+    "false_statements": 0,
+    "conversation": 1,
+    "summary": 2,
+    "combine": 2,
+}
+
+templates = {
+    "conversation": convo_template,
+    "summary": summary_template,
+    "combine": combine_template,
+    "name_fact": name_fact,
+    "false_statements": false_facts_template,
+}
+
+
+def cache_key(template: str, inputs: dict[str, object], model_name: str = MODEL_NAME) -> str:
+    """Return the cache key of a prompt: its template, model and a hash of its whitespace normalized inputs."""
+    normalized = {name: " ".join(str(value).split()) for name, value in sorted(inputs.items())}
+    digest = hashlib.sha256(json.dumps(normalized).encode()).hexdigest()
+    return f"{template}:{model_name}:{digest}"
+
+
+def is_blocked(response: "generation_types.AsyncGenerateContentResponse") -> bool:
+    """Whether the prompt or its answer was blocked for safety reasons."""
+    if response.prompt_feedback.block_reason:
+        return True
+    return bool(response.candidates) and response.candidates[0].finish_reason.name == "SAFETY"
+
+
+def is_answered(response: "generation_types.AsyncGenerateContentResponse") -> bool:
+    """Whether the model finished its answer normally."""
+    return bool(response.candidates) and response.candidates[0].finish_reason.name == "STOP"
+
+
+class JSONArrayParser:
+    """Incremental parser returning the elements of a streamed JSON array as soon as each is complete."""
+
+    def __init__(self) -> None:
+        self.buffer = ""
+        self.is_array: bool | None = None
+        self._position = 0
+        self._depth = 0
+        self._start: int | None = None
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text: str) -> list:
+        """Add text to the stream and return the elements completed by it."""
+        self.buffer += text
+        elements = []
+        for position in range(self._position, len(self.buffer)):
+            char = self.buffer[position]
+            if self._in_string:
+                self._read_string(char)
+            elif self.is_array is None:
+                if not char.isspace():
+                    self.is_array = char == "["
+                    self._depth = 1
+            elif self.is_array:
+                self._read(char, position, elements)
+        self._position = len(self.buffer)
+        return elements
+
+    def _read_string(self, char: str) -> None:
+        if self._escaped:
+            self._escaped = False
+        elif char == "\\":
+            self._escaped = True
+        elif char == '"':
+            self._in_string = False
+
+    def _read(self, char: str, position: int, elements: list) -> None:
+        if self._depth == 1 and char in ",]":
+            # End of an element of the array
+            if self._start is not None:
+                elements.append(json.loads(self.buffer[self._start : position]))
+                self._start = None
+            if char == "]":
+                self._depth = 0
+            return
+        if self._depth == 1 and self._start is None and not char.isspace():
+            self._start = position
+
+        if char == '"':
+            self._in_string = True
+        elif char in "[{":
+            self._depth += 1
+        elif char in "]}":
+            self._depth -= 1
+
+
+def parse_conversation(text: str) -> Iterator[dict]:
+    """Yield the messages of a generated conversation, or its error as a single `{"summary": ...}` dict."""
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = None
+    if isinstance(data, list):
+        yield from data
+    elif isinstance(data, dict):
+        yield data
+    else:
+        yield {"summary": "Failed to generate a conversation on given topic."}
+
+
+class StreamBroadcast:
+    """Messages of one streamed answer, replayed from the start to every reader as they arrive."""
+
+    def __init__(self) -> None:
+        self.messages: list[dict] = []
+        self.done = False
+        self._changed = asyncio.Event()
+
+    def put(self, message: dict) -> None:
+        """Add a message and wake the readers."""
+        self.messages.append(message)
+        self._wake()
+
+    def close(self) -> None:
+        """End the stream and wake the readers."""
+        self.done = True
+        self._wake()
+
+    async def read(self) -> AsyncIterator[dict]:
+        """Yield every message of the stream, waiting for the ones not generated yet."""
+        index = 0
+        while True:
+            changed = self._changed
+            while index < len(self.messages):
+                yield self.messages[index]
+                index += 1
+            if self.done:
+                return
+            await changed.wait()
+
+    def _wake(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
 
 class Gemini:
     """Gemini API Client."""
 
     def __init__(self) -> None:
-        """Initialize Gemini API Client."""
-        self.safety_settings = {
-            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_LOW_AND_ABOVE,
-            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_LOW_AND_ABOVE,
-            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_LOW_AND_ABOVE,
-            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_LOW_AND_ABOVE,
-        }
+        """Initialize Gemini API Client. The model is built on first use."""
         self.finish_errors = {
             "MAX_TOKENS": "The maximum number of tokens as specified in the request was reached.",
             "SAFETY": "The content was blocked for safety reasons.",
@@ -51,35 +236,124 @@ class Gemini:
             "OTHER": "There was an error for Unknown reason.",
         }
 
-        self.model = genai.GenerativeModel(
-            model_name="gemini-1.5-flash",
-            generation_config={"response_mime_type": "application/json"},
-            safety_settings=self.safety_settings,
-        )
+        self._model: genai.GenerativeModel | None = None
+        self.cache = TieredCache(CACHE_DIR / "gemini.db", maxsize=1024)
+        self.cache_hits = Counter()
+        self.cache_misses = Counter()
+        self.governor = RequestGovernor(GEMINI_CONCURRENCY, GEMINI_REQUESTS_PER_MINUTE, GEMINI_TOKENS_PER_MINUTE)
+        self.in_flight = SingleFlight()
+        self._streams: dict[str, StreamBroadcast] = {}
+        self._stream_tasks: set[asyncio.Task] = set()
+
+    @property
+    def model(self) -> "genai.GenerativeModel":
+        """Return the Gemini model, importing and configuring the SDK on first use."""
+        if self._model is None:
+            # The SDK takes a good part of a second to import, so it is left out of startup
+            import google.generativeai as genai
+            from google.generativeai.types import HarmBlockThreshold, HarmCategory
+
+            genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+            safety_settings = {
+                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_LOW_AND_ABOVE,
+                HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_LOW_AND_ABOVE,
+                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_LOW_AND_ABOVE,
+                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_LOW_AND_ABOVE,
+            }
+            self._model = genai.GenerativeModel(
+                model_name=MODEL_NAME,
+                generation_config={"response_mime_type": "application/json"},
+                safety_settings=safety_settings,
+            )
+        return self._model
+
+    async def generate(self, template: str, **inputs: object) -> str:
+        """Fill a prompt template, answering from the response cache when possible."""
+        ttl = CACHE_TTLS.get(template)
+        key = cache_key(template, inputs)
+        if ttl is not None and (text := self.cache.get(key, MISSING)) is not MISSING:
+            self.cache_hits[template] += 1
+            return text
+        self.cache_misses[template] += 1
+
+        # Identical prompts already on their way share the answer
+        return await self.in_flight.do(key, lambda: self._request(template, key, templates[template].format(**inputs)))
+
+    async def _request(self, template: str, key: str, prompt: str) -> str:
+        """Send a prompt once the governor admits it, and cache the answer."""
+        async with self.governor.slot(PRIORITIES.get(template, 0), len(prompt) // CHARS_PER_TOKEN):
+            response = await self.model.generate_content_async(prompt)
+        text = await self.verify(response)
+
+        if (ttl := CACHE_TTLS.get(template)) is None:
+            return text
+        if is_blocked(response):
+            self.cache.set(key, text, ttl=BLOCKED_TTL)
+        elif is_answered(response):
+            self.cache.set(key, text, ttl=ttl)
+        return text
 
     async def generate_conversation(self, prompt: str) -> str:
         """Generate a conversation based on the given topic."""
-        response = await self.model.generate_content_async(
-            convo_template.format(topic=prompt),
-        )
+        return await self.generate("conversation", topic=prompt)
 
-        return await self.verify(response)
+    async def stream_conversation(self, prompt: str) -> AsyncIterator[dict]:
+        """Generate a conversation, yielding every message as soon as it is generated.
+
+        If no conversation could be generated, a single `{"summary": ...}` dict describing the error is yielded.
+        """
+        # Identical topics already on their way share the stream
+        key = cache_key("conversation", {"topic": prompt})
+        if (stream := self._streams.get(key)) is None:
+            stream = self._streams[key] = StreamBroadcast()
+            # Generation runs in its own task, so slow readers do not hold a governor slot
+            task = asyncio.create_task(self._stream_request(key, convo_template.format(topic=prompt), stream))
+            self._stream_tasks.add(task)
+            task.add_done_callback(self._stream_tasks.discard)
+        async for message in stream.read():
+            yield message
+
+    async def _stream_request(self, key: str, prompt: str, messages: StreamBroadcast) -> None:
+        """Stream a conversation into `messages` and close it."""
+        parser = JSONArrayParser()
+        sent = 0
+        try:
+            async with self.governor.slot(PRIORITIES["conversation"], len(prompt) // CHARS_PER_TOKEN):
+                response = await self.model.generate_content_async(prompt, stream=True)
+                async for chunk in response:
+                    for message in parser.feed(chunk.text):
+                        messages.put(message)
+                        sent += 1
+
+            text = await self.verify(response)
+            if not sent:
+                for message in parse_conversation(text):
+                    messages.put(message)
+        except Exception:
+            logger.exception("Streaming a conversation failed.")
+            if not sent:
+                messages.put({"summary": "Failed to generate a conversation on given topic."})
+        finally:
+            del self._streams[key]
+            messages.close()
 
     async def summarize_conversation(self, text: str) -> str:
         """Summarize the conversation."""
-        response = await self.model.generate_content_async(
-            summary_template.format(text=text),
-        )
-        return await self.verify(response)
+        return await self.generate("summary", text=text)
+
+    async def combine_summaries(self, summaries: list[str]) -> str:
+        """Combine summaries of consecutive parts of a conversation into one."""
+        return await self.generate("combine", summaries="\n\n".join(summaries))
+
+    async def create_false_statements(self, facts: list[str]) -> str:
+        """Create a false statement for every fact, in one request."""
+        return await self.generate("false_statements", facts=json.dumps(facts), count=len(facts))
 
     async def name_fun_fact(self, name: str) -> str:
         """Give a fun fact about username, if nothing found, return False."""
-        response = await self.model.generate_content_async(
-            name_fact.format(name=name),
-        )
-        return await self.verify(response)
+        return await self.generate("name_fact", name=name)
 
-    async def verify(self, response: generation_types.AsyncGenerateContentResponse) -> str:
+    async def verify(self, response: "generation_types.AsyncGenerateContentResponse") -> str:
         """Verify the content of the output and return a valid response."""
         if response.prompt_feedback.block_reason:
             reason = response.prompt_feedback.block_reason.name
@@ -87,7 +361,7 @@ class Gemini:
                 message = "Your request was blocked because of safety reasons."
             else:
                 message = "Your request was blocked because of other reasons."
-            return f'{{"summary": {message}}}'
+            return json.dumps({"summary": message})
         if response.candidates[0].finish_reason not in [
             "STOP",
             "FINISH_REASON_UNSPECIFIED",
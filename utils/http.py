@@ -0,0 +1,198 @@
+import json
+import logging
+import time
+from collections import defaultdict
+from collections.abc import AsyncIterator
+from dataclasses import dataclass
+from typing import Any
+from urllib.parse import urlsplit
+
+import aiohttp
+
+logger = logging.getLogger("http")
+
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=10, connect=3, sock_read=5)
+MAX_RESPONSE_SIZE = 4 * 1024 * 1024  # 4 MiB
+USER_AGENT = "CodeJamBot/0.1 (https://github.com/Abhishek10351/Summer-Code-Jam-2024)"
+
+
+class ResponseTooLargeError(aiohttp.ClientError):
+    """Response body exceeded the configured size cap."""
+
+
+@dataclass
+class HostStats:
+    """Request counters for a single host."""
+
+    requests: int = 0
+    errors: int = 0
+    bytes_received: int = 0
+    total_latency: float = 0.0
+
+    @property
+    def average_latency(self) -> float:
+        """Average latency of the requests in seconds."""
+        return self.total_latency / self.requests if self.requests else 0.0
+
+
+class HTTPClient:
+    """Shared keep-alive HTTP transport for every outbound call of the bot."""
+
+    def __init__(
+        self,
+        *,
+        limit: int = 100,
+        limit_per_host: int = 10,
+        dns_cache_ttl: int = 300,
+        timeout: aiohttp.ClientTimeout = DEFAULT_TIMEOUT,
+        max_response_size: int = MAX_RESPONSE_SIZE,
+    ) -> None:
+        """Initialize the client. The session itself is created in `start`."""
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.timeout = timeout
+        self.max_response_size = max_response_size
+        self.stats: dict[str, HostStats] = defaultdict(HostStats)
+        self._session: aiohttp.ClientSession | None = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Return the underlying session, creating it if needed."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_cache_ttl,
+                use_dns_cache=True,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                headers={"User-Agent": USER_AGENT},
+            )
+            logger.info("HTTP session started.")
+        return self._session
+
+    async def start(self) -> None:
+        """Open the connection pool."""
+        _ = self.session
+
+    async def close(self) -> None:
+        """Close the connection pool."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("HTTP session closed.")
+        self._session = None
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        params: dict | None = None,
+        headers: dict | None = None,
+        timeout: float | None = None,
+        max_size: int | None = None,
+        raise_for_status: bool = True,
+    ) -> tuple[int, bytes]:
+        """Send a request and return the status code and the (size capped) body."""
+        max_size = max_size or self.max_response_size
+        host = urlsplit(url).hostname or ""
+        stats = self.stats[host]
+        kwargs = {"params": params, "headers": headers}
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+
+        start = time.perf_counter()
+        try:
+            async with self.session.request(method, url, **kwargs) as response:
+                if raise_for_status:
+                    response.raise_for_status()
+                body = await read_capped(response, max_size)
+                status = response.status
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            stats.requests += 1
+            stats.total_latency += time.perf_counter() - start
+
+        stats.bytes_received += len(body)
+        return status, body
+
+    async def stream(
+        self,
+        url: str,
+        *,
+        params: dict | None = None,
+        headers: dict | None = None,
+        timeout: float | None = None,
+        max_size: int | None = None,
+        chunk_size: int = 16 * 1024,
+    ) -> AsyncIterator[bytes]:
+        """GET a url and yield its body in chunks as they arrive.
+
+        Close the generator (e.g. with `contextlib.aclosing`) to stop reading early.
+        """
+        max_size = max_size or self.max_response_size
+        stats = self.stats[urlsplit(url).hostname or ""]
+        kwargs = {"params": params, "headers": headers}
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+
+        start = time.perf_counter()
+        received = 0
+        try:
+            async with self.session.get(url, **kwargs) as response:
+                response.raise_for_status()
+                async for chunk in iter_capped(response, max_size, chunk_size):
+                    received += len(chunk)
+                    yield chunk
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            stats.requests += 1
+            stats.bytes_received += received
+            stats.total_latency += time.perf_counter() - start
+
+    async def get_json(self, url: str, **kwargs: Any) -> Any:  # noqa: ANN401
+        """GET a url and decode the body as JSON."""
+        _, body = await self.request("GET", url, **kwargs)
+        return json.loads(body)
+
+    async def get_text(self, url: str, **kwargs: Any) -> str:  # noqa: ANN401
+        """GET a url and decode the body as text."""
+        _, body = await self.request("GET", url, **kwargs)
+        return body.decode("utf-8", errors="replace")
+
+
+async def iter_capped(
+    response: aiohttp.ClientResponse,
+    max_size: int,
+    chunk_size: int = 64 * 1024,
+) -> AsyncIterator[bytes]:
+    """Yield a response body in chunks, refusing to read more than `max_size` bytes."""
+    if response.content_length and response.content_length > max_size:
+        msg = f"{response.url.host} announced {response.content_length} bytes, cap is {max_size}"
+        raise ResponseTooLargeError(msg)
+
+    received = 0
+    async for chunk in response.content.iter_chunked(chunk_size):
+        received += len(chunk)
+        if received > max_size:
+            msg = f"{response.url.host} sent more than {max_size} bytes"
+            raise ResponseTooLargeError(msg)
+        yield chunk
+
+
+async def read_capped(response: aiohttp.ClientResponse, max_size: int) -> bytes:
+    """Read a response body, refusing to buffer more than `max_size` bytes."""
+    body = bytearray()
+    async for chunk in iter_capped(response, max_size):
+        body += chunk
+    return bytes(body)
+
+
+http_client = HTTPClient()
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import random
+from array import array
+from collections.abc import Iterable
+
+import discord
+
+from utils.cache import TTLCache
+
+logger = logging.getLogger("members")
+
+# Seconds a resolved display name is reused
+NAME_TTL = 5 * 60
+# Most user ids the gateway accepts in one member request
+QUERY_LIMIT = 100
+
+
+class MemberResolver:
+    """Resolve display names of guild members with as few requests as possible.
+
+    Names come from the gateway member cache first, then from a short lived
+    name cache, and only then from batched gateway member requests.
+    """
+
+    def __init__(self, ttl: float = NAME_TTL, maxsize: int = 10_000) -> None:
+        self.names = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def remember(self, member: discord.Member) -> None:
+        """Cache the display name of a member we already have."""
+        self.names.set((member.guild.id, member.id), member.display_name)
+
+    def get_name(self, guild: discord.Guild, user_id: int) -> str | None:
+        """Return the display name of a member without any request, if known."""
+        if member := guild.get_member(user_id):
+            return member.display_name
+        return self.names.get((guild.id, user_id))
+
+    async def resolve(self, guild: discord.Guild, user_ids: list[int]) -> dict[int, str]:
+        """Return the display names of the members among `user_ids`."""
+        names = {}
+        misses = []
+        for user_id in dict.fromkeys(user_ids):
+            if (name := self.get_name(guild, user_id)) is not None:
+                names[user_id] = name
+            else:
+                misses.append(user_id)
+
+        if misses:
+            batches = [misses[i : i + QUERY_LIMIT] for i in range(0, len(misses), QUERY_LIMIT)]
+            results = await asyncio.gather(
+                *(guild.query_members(user_ids=batch, limit=len(batch)) for batch in batches),
+                return_exceptions=True,
+            )
+            for result in results:
+                if isinstance(result, BaseException):
+                    logger.warning("Member query in guild %s failed: %r", guild.id, result)
+                    continue
+                for member in result:
+                    self.remember(member)
+                    names[member.id] = member.display_name
+        return names
+
+
+class GuildMembers:
+    """Ids of the non-bot members of one guild, packed for removal and sampling in constant time."""
+
+    def __init__(self, member_ids: Iterable[int], *, complete: bool) -> None:
+        self.ids = array("Q", member_ids)
+        self.positions = {member_id: position for position, member_id in enumerate(self.ids)}
+        self.complete = complete
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, member_id: int) -> None:
+        """Add a member id."""
+        if member_id not in self.positions:
+            self.positions[member_id] = len(self.ids)
+            self.ids.append(member_id)
+
+    def remove(self, member_id: int) -> None:
+        """Remove a member id, moving the last id into its place."""
+        if (position := self.positions.pop(member_id, None)) is None:
+            return
+        last = self.ids.pop()
+        if last != member_id:
+            self.ids[position] = last
+            self.positions[last] = position
+
+
+class MemberIndex:
+    """Non-bot members of every guild, kept up to date by member events.
+
+    A guild is indexed on first use, and again once its member list has
+    been chunked, so commands pick random members without copying the
+    member list of the guild.
+    """
+
+    def __init__(self) -> None:
+        self.guilds: dict[int, GuildMembers] = {}
+
+    def add(self, member: discord.Member) -> None:
+        """Index a member that joined, unless it is a bot."""
+        if not member.bot and (members := self.guilds.get(member.guild.id)) is not None:
+            members.add(member.id)
+
+    def remove(self, member: discord.Member) -> None:
+        """Drop a member that left."""
+        if (members := self.guilds.get(member.guild.id)) is not None:
+            members.remove(member.id)
+
+    def invalidate(self, guild_id: int | None = None) -> None:
+        """Rebuild the index of a guild, or of every guild, on next use."""
+        if guild_id is None:
+            self.guilds.clear()
+        else:
+            self.guilds.pop(guild_id, None)
+
+    def sample(self, guild: discord.Guild, k: int, exclude: Iterable[int] = ()) -> list[discord.Member]:
+        """Return `k` distinct random non-bot members, leaving out the ids in `exclude`."""
+        members = self._index(guild)
+        excluded = {member_id for member_id in exclude if member_id in members.positions}
+        picked = {}
+        while len(picked) < k:
+            if len(members) - len(excluded) < k:
+                msg = "Sample larger than the non-bot members of the guild"
+                raise ValueError(msg)
+            member_id = members.ids[random.randrange(len(members))]  # noqa: S311
+            if member_id in excluded or member_id in picked:
+                continue
+            if (member := guild.get_member(member_id)) is None:
+                # Left without an event reaching the bot
+                members.remove(member_id)
+                continue
+            picked[member_id] = member
+        return list(picked.values())
+
+    def choice(self, guild: discord.Guild) -> discord.Member:
+        """Return a random non-bot member."""
+        return self.sample(guild, 1)[0]
+
+    def _index(self, guild: discord.Guild) -> GuildMembers:
+        members = self.guilds.get(guild.id)
+        if members is None or (not members.complete and guild.chunked):
+            members = GuildMembers(
+                (member.id for member in guild.members if not member.bot),
+                complete=guild.chunked,
+            )
+            self.guilds[guild.id] = members
+        return members
+
+
+member_resolver = MemberResolver()
+member_index = MemberIndex()
@@ -0,0 +1,239 @@
+import bisect
+import dataclasses
+import os
+from collections import Counter, defaultdict
+from collections.abc import AsyncIterator
+
+import discord
+
+from utils.members import member_resolver
+
+# Bytes of stored messages kept per guild, the oldest are dropped beyond it
+GUILD_MEMORY_CAP = int(os.getenv("MESSAGE_STORE_GUILD_BYTES", str(4 * 1024 * 1024)))
+# Rough bytes a stored message takes besides its content
+RECORD_OVERHEAD = 120
+# Dropped messages kept in a buffer before its lists are compacted
+COMPACT_THRESHOLD = 1024
+
+
+@dataclasses.dataclass(slots=True)
+class MessageRecord:
+    """Compact copy of a message."""
+
+    id: int
+    author_id: int
+    # Kept since webhook authors and members who left cannot be resolved later
+    author_name: str
+    created_at: float
+    content: str
+
+    @classmethod
+    def from_message(cls, message: discord.Message) -> "MessageRecord":
+        """Copy the parts of a message the bot needs."""
+        return cls(
+            message.id,
+            message.author.id,
+            message.author.display_name,
+            message.created_at.timestamp(),
+            message.content,
+        )
+
+    @property
+    def size(self) -> int:
+        """Approximate memory taken by the record."""
+        return RECORD_OVERHEAD + len(self.author_name) + len(self.content)
+
+
+class ChannelBuffer:
+    """Recent messages of a channel in id order, dropping the oldest first.
+
+    Every message with an id from `covered_from` on is known, so ranges
+    are answered with a binary search over the ids.
+    """
+
+    def __init__(self, covered_from: int) -> None:
+        self.covered_from = covered_from
+        self.size = 0
+        self._ids: list[int] = []
+        self._records: list[MessageRecord | None] = []
+        self._head = 0
+
+    def __len__(self) -> int:
+        return len(self._ids) - self._head
+
+    @property
+    def oldest_id(self) -> int | None:
+        """Id of the oldest kept message."""
+        return self._ids[self._head] if len(self) else None
+
+    def add(self, record: MessageRecord) -> int:
+        """Store a message. Return how many bytes the buffer grew by."""
+        if record.id < self.covered_from:
+            return 0
+        if not len(self) or record.id > self._ids[-1]:
+            self._ids.append(record.id)
+            self._records.append(record)
+            self.size += record.size
+            return record.size
+
+        index = bisect.bisect_left(self._ids, record.id, self._head)
+        if index < len(self._ids) and self._ids[index] == record.id:
+            return self.replace(index, record)
+        self._ids.insert(index, record.id)
+        self._records.insert(index, record)
+        self.size += record.size
+        return record.size
+
+    def get(self, message_id: int) -> MessageRecord | None:
+        """Return a stored message."""
+        index = self._find(message_id)
+        return self._records[index] if index is not None else None
+
+    def edit(self, message_id: int, content: str) -> int:
+        """Update the content of a stored message. Return how many bytes the buffer grew by."""
+        if (index := self._find(message_id)) is None or (record := self._records[index]) is None:
+            return 0
+        return self.replace(index, dataclasses.replace(record, content=content))
+
+    def delete(self, message_id: int) -> int:
+        """Forget a deleted message, keeping its place. Return how many bytes were freed."""
+        if (index := self._find(message_id)) is None or (record := self._records[index]) is None:
+            return 0
+        self._records[index] = None
+        self.size -= record.size
+        return record.size
+
+    def replace(self, index: int, record: MessageRecord | None) -> int:
+        """Replace the message at an index. Return how many bytes the buffer grew by."""
+        old = self._records[index]
+        self._records[index] = record
+        grown = (record.size if record else 0) - (old.size if old else 0)
+        self.size += grown
+        return grown
+
+    def pop_oldest(self) -> int:
+        """Drop the oldest message. Return how many bytes were freed."""
+        record = self._records[self._head]
+        self.covered_from = self._ids[self._head] + 1
+        self._records[self._head] = None
+        self._head += 1
+        if self._head > COMPACT_THRESHOLD and self._head * 2 > len(self._ids):
+            del self._ids[: self._head]
+            del self._records[: self._head]
+            self._head = 0
+
+        freed = record.size if record else 0
+        self.size -= freed
+        return freed
+
+    def range(self, first_id: int, last_id: int) -> list[MessageRecord]:
+        """Return the stored messages with ids from `first_id` to `last_id`, oldest first."""
+        start = bisect.bisect_left(self._ids, first_id, self._head)
+        end = bisect.bisect_right(self._ids, last_id, start)
+        return [record for record in self._records[start:end] if record is not None]
+
+    def _find(self, message_id: int) -> int | None:
+        index = bisect.bisect_left(self._ids, message_id, self._head)
+        return index if index < len(self._ids) and self._ids[index] == message_id else None
+
+
+class MessageStore:
+    """Opt-in ring buffers of the recent messages of channels, fed by gateway events.
+
+    The channels of a guild share a memory cap, beyond which the oldest
+    messages of the guild are dropped first.
+    """
+
+    def __init__(self, guild_cap: int = GUILD_MEMORY_CAP) -> None:
+        self.guild_cap = guild_cap
+        self.buffers: dict[int, ChannelBuffer] = {}
+        self.guild_channels: dict[int, set[int]] = defaultdict(set)
+        self.guild_sizes = Counter()
+
+    def enable(self, guild_id: int, channel_id: int) -> None:
+        """Start storing the messages of a channel."""
+        if channel_id not in self.buffers:
+            self.buffers[channel_id] = ChannelBuffer(discord.utils.time_snowflake(discord.utils.utcnow()))
+            self.guild_channels[guild_id].add(channel_id)
+
+    def disable(self, guild_id: int, channel_id: int) -> None:
+        """Stop storing the messages of a channel and drop them."""
+        if (buffer := self.buffers.pop(channel_id, None)) is not None:
+            self.guild_sizes[guild_id] -= buffer.size
+            self.guild_channels[guild_id].discard(channel_id)
+
+    def reset(self) -> None:
+        """Drop every stored message, after events may have been missed."""
+        for guild_id, channel_ids in self.guild_channels.items():
+            for channel_id in channel_ids:
+                self.buffers[channel_id] = ChannelBuffer(discord.utils.time_snowflake(discord.utils.utcnow()))
+            self.guild_sizes[guild_id] = 0
+
+    def add(self, message: discord.Message) -> None:
+        """Store a new message of an opted in channel."""
+        if (buffer := self.buffers.get(message.channel.id)) is None or message.guild is None:
+            return
+        self.guild_sizes[message.guild.id] += buffer.add(MessageRecord.from_message(message))
+        self._trim(message.guild.id)
+
+    def edit(self, guild_id: int | None, channel_id: int, message_id: int, content: str) -> None:
+        """Update a stored message."""
+        if (buffer := self.buffers.get(channel_id)) is not None and guild_id is not None:
+            self.guild_sizes[guild_id] += buffer.edit(message_id, content)
+            self._trim(guild_id)
+
+    def delete(self, guild_id: int | None, channel_id: int, message_id: int) -> None:
+        """Forget a deleted message."""
+        if (buffer := self.buffers.get(channel_id)) is not None and guild_id is not None:
+            self.guild_sizes[guild_id] -= buffer.delete(message_id)
+
+    def get(self, channel_id: int, message_id: int) -> MessageRecord | None:
+        """Return a stored message."""
+        buffer = self.buffers.get(channel_id)
+        return buffer.get(message_id) if buffer is not None else None
+
+    async def history(
+        self,
+        channel: discord.abc.Messageable,
+        first_id: int,
+        last_id: int,
+    ) -> AsyncIterator[MessageRecord]:
+        """Yield the messages with ids from `first_id` to `last_id`, oldest first.
+
+        Only the part of the range older than the stored messages is fetched through the API.
+        """
+        buffer = self.buffers.get(channel.id)
+        covered_from = buffer.covered_from if buffer is not None else last_id + 1
+        # Taken before paging, so messages dropped meanwhile are not missed
+        stored = buffer.range(max(first_id, covered_from), last_id) if buffer is not None else []
+
+        if first_id < covered_from:
+            history = channel.history(
+                after=discord.Object(first_id - 1),
+                before=discord.Object(min(last_id + 1, covered_from)),
+                limit=None,
+                oldest_first=True,
+            )
+            async for message in history:
+                if isinstance(message.author, discord.Member):
+                    member_resolver.remember(message.author)
+                yield MessageRecord.from_message(message)
+
+        for record in stored:
+            yield record
+
+    def _trim(self, guild_id: int) -> None:
+        """Drop the oldest messages of a guild until it fits its memory cap."""
+        while self.guild_sizes[guild_id] > self.guild_cap:
+            buffers = [self.buffers[channel_id] for channel_id in self.guild_channels[guild_id]]
+            oldest = min(
+                (buffer for buffer in buffers if len(buffer)),
+                key=lambda buffer: buffer.oldest_id,
+                default=None,
+            )
+            if oldest is None:
+                return
+            self.guild_sizes[guild_id] -= oldest.pop_oldest()
+
+
+message_store = MessageStore()
@@ -0,0 +1,142 @@
+import hashlib
+import logging
+import random
+import sqlite3
+from array import array
+from pathlib import Path
+
+logger = logging.getLogger("question_bank")
+
+DIFFICULTIES = ("easy", "medium", "hard")
+TYPES = ("multiple", "boolean")
+SEPARATOR = "\x1f"
+ROW_COLUMNS = "category, difficulty, type, question, correct_answer, incorrect_answers"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    hash BLOB NOT NULL UNIQUE,
+    category INTEGER NOT NULL,
+    difficulty INTEGER NOT NULL,
+    type INTEGER NOT NULL,
+    question TEXT NOT NULL,
+    correct_answer TEXT NOT NULL,
+    incorrect_answers TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS questions_lookup ON questions (category, difficulty, type);
+"""
+
+
+def question_hash(question: str, correct_answer: str) -> bytes:
+    """Return the content hash used to deduplicate questions."""
+    content = f"{question.strip().casefold()}{SEPARATOR}{correct_answer.strip().casefold()}"
+    return hashlib.blake2b(content.encode(), digest_size=12).digest()
+
+
+class QuestionBank:
+    """Persistent trivia question store, indexed by category, difficulty and type.
+
+    Questions are stored already unescaped. Only the row ids of the queried
+    (category, difficulty, type) combinations are kept in memory, as compact
+    arrays, so random sampling never scans the table.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._connection: sqlite3.Connection | None = None
+        self._ids: dict[tuple, array] = {}
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Return the database connection, opening it on first use."""
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.path)
+            self._connection.executescript(
+                "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; PRAGMA cache_size=-2048;" + SCHEMA,
+            )
+        return self._connection
+
+    def add(self, quizzes: list[dict], category: int) -> int:
+        """Store unescaped opentdb results of one category. Return how many were new."""
+        rows = [
+            (
+                question_hash(quiz["question"], quiz["correct_answer"]),
+                category,
+                DIFFICULTIES.index(quiz["difficulty"]),
+                TYPES.index(quiz["type"]),
+                quiz["question"],
+                quiz["correct_answer"],
+                SEPARATOR.join(quiz["incorrect_answers"]),
+            )
+            for quiz in quizzes
+            if quiz.get("difficulty") in DIFFICULTIES and quiz.get("type") in TYPES
+        ]
+        with self.connection as connection:
+            before = connection.total_changes
+            connection.executemany(
+                "INSERT OR IGNORE INTO questions "
+                "(hash, category, difficulty, type, question, correct_answer, incorrect_answers) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            added = connection.total_changes - before
+
+        if added:
+            # Id arrays of this category are stale now
+            self._ids = {key: ids for key, ids in self._ids.items() if key[0] not in (category, None)}
+            logger.debug("Stored %s new questions for category %s.", added, category)
+        return added
+
+    def sample(
+        self,
+        amount: int,
+        category: int | None = None,
+        difficulty: str | None = None,
+        type: str | None = None,
+    ) -> list[dict]:
+        """Return up to `amount` random questions matching the filters, in opentdb's format."""
+        ids = self._lookup(category, difficulty, type)
+        if not ids:
+            return []
+
+        picked = [ids[i] for i in random.sample(range(len(ids)), min(amount, len(ids)))]
+        placeholders = ", ".join("?" * len(picked))
+        query = f"SELECT {ROW_COLUMNS} FROM questions WHERE id IN ({placeholders})"  # noqa: S608
+        rows = self.connection.execute(query, picked)
+        return [
+            {
+                "category_id": category_id,
+                "difficulty": DIFFICULTIES[difficulty_index],
+                "type": TYPES[type_index],
+                "question": question,
+                "correct_answer": correct_answer,
+                "incorrect_answers": incorrect_answers.split(SEPARATOR) if incorrect_answers else [],
+            }
+            for category_id, difficulty_index, type_index, question, correct_answer, incorrect_answers in rows
+        ]
+
+    def count(self, category: int | None = None) -> int:
+        """Return the number of stored questions, optionally for one category."""
+        return len(self._lookup(category, None, None))
+
+    def close(self) -> None:
+        """Close the database connection."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _lookup(self, category: int | None, difficulty: str | None, type: str | None) -> array:
+        """Return the row ids matching the filters, loading them through the index once."""
+        key = (category, difficulty, type)
+        if key not in self._ids:
+            filters = {
+                "category": category,
+                "difficulty": DIFFICULTIES.index(difficulty) if difficulty in DIFFICULTIES else None,
+                "type": TYPES.index(type) if type in TYPES else None,
+            }
+            filters = {column: value for column, value in filters.items() if value is not None}
+            where = " AND ".join(f"{column} = ?" for column in filters) or "1"
+            cursor = self.connection.execute(f"SELECT id FROM questions WHERE {where}", list(filters.values()))  # noqa: S608
+            self._ids[key] = array("q", (row[0] for row in cursor))
+        return self._ids[key]
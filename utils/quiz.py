@@ -1,25 +1,57 @@
 import asyncio
+import contextlib
+import hashlib
 import html
+import json
+import logging
+import os
 import random
-from collections import defaultdict
+import re
+import time
+from collections import defaultdict, deque
 from pathlib import Path
+from urllib.parse import parse_qs, quote, urlsplit
 
 import aiohttp
 import discord
-import requests
 from bs4 import BeautifulSoup
 
+from utils.cache import CACHE_DIR, TieredCache
 from utils.database import db
-
-# Setup paths
-CACHE_DIR = Path(".cache")
-CACHE_DIR.mkdir(exist_ok=True)
-
-
-def fetch_categories() -> dict:
+from utils.http import http_client
+from utils.members import member_resolver
+from utils.question_bank import QuestionBank
+from utils.throttle import RateLimiter, SingleFlight
+from utils.wiki import WIKI_API, WIKI_PAGE
+
+logger = logging.getLogger("quiz")
+
+# Number of questions buffered ahead per topic id during a quiz
+PREFETCH_DEPTH = int(os.getenv("QUIZ_PREFETCH_DEPTH", "3"))
+# OpenTDB allows one request every 5 seconds per IP
+OPENTDB_COOLDOWN = 5
+# Seconds a question request may queue for the rate limit before using the question bank
+OPENTDB_QUEUE_TIME = 5
+# Seconds to wait for OpenTDB before serving questions from the question bank
+OPENTDB_TIMEOUT = 3
+# Response codes meaning the session token is unknown or exhausted
+TOKEN_ERRORS = (3, 4)
+# Seconds before the category catalogue is refreshed
+CATEGORY_TTL = 24 * 60 * 60
+# Seconds allowed for resolving a learn more link
+LINK_TIMEOUT = 5
+DEFAULT_LINK = "https://en.wikipedia.org"
+
+opentdb_limiter = RateLimiter(OPENTDB_COOLDOWN)
+question_bank = QuestionBank(CACHE_DIR / "questions.db")
+link_cache = TieredCache(CACHE_DIR / "links.db", ttl=30 * 24 * 60 * 60)
+
+
+async def fetch_categories() -> dict:
     """Create structured categories."""
-    response = requests.get("https://opentdb.com/api_category.php", timeout=(3, 5))
-    raw_categories = response.json()["trivia_categories"]
+    await opentdb_limiter.acquire()
+    response = await http_client.get_json("https://opentdb.com/api_category.php")
+    raw_categories = response["trivia_categories"]
 
     structured_categories = defaultdict(dict)
 
@@ -36,24 +68,108 @@ def fetch_categories() -> dict:
     return structured_categories
 
 
-# defaultdict(<class 'dict'>, {'General Knowledge': 9, 'Entertainment': {'Books': 10, 'Film': 11, 'Music': 12, 'Musicals & Theatres': 13, 'Television': 14, 'Video Games': 15, 'Board Games': 16, 'Comics': 29, 'Japanese Anime & Manga': 31, 'Cartoon & Animations': 32}, 'Science & Nature': 17, 'Science': {'Computers': 18, 'Mathematics': 19, 'Gadgets': 30}, 'Mythology': 20, 'Sports': 21, 'Geography': 22, 'History': 23, 'Politics': 24, 'Art': 25, 'Celebrities': 26, 'Animals': 27, 'Vehicles': 28})  # noqa: E501
-
-TOPICS_POOL = fetch_categories()
+# Used until the first snapshot is written, so a cold start never needs opentdb
+DEFAULT_CATEGORIES = {
+    "General Knowledge": 9,
+    "Entertainment": {
+        "Books": 10,
+        "Film": 11,
+        "Music": 12,
+        "Musicals & Theatres": 13,
+        "Television": 14,
+        "Video Games": 15,
+        "Board Games": 16,
+        "Comics": 29,
+        "Japanese Anime & Manga": 31,
+        "Cartoon & Animations": 32,
+    },
+    "Science & Nature": 17,
+    "Science": {"Computers": 18, "Mathematics": 19, "Gadgets": 30},
+    "Mythology": 20,
+    "Sports": 21,
+    "Geography": 22,
+    "History": 23,
+    "Politics": 24,
+    "Art": 25,
+    "Celebrities": 26,
+    "Animals": 27,
+    "Vehicles": 28,
+}
+
+
+class CategoryCatalogue:
+    """Opentdb categories, kept in memory and in a disk snapshot, refreshed in the background."""
+
+    def __init__(self, path: Path, ttl: float = CATEGORY_TTL) -> None:
+        self.path = path
+        self.ttl = ttl
+        self._topics: dict | None = None
+        self._fetched_at = 0.0
+        self._refresh_task: asyncio.Task | None = None
+
+    @property
+    def topics(self) -> dict:
+        """Return the categories, loading them on first use and refreshing them once stale."""
+        if self._topics is None:
+            self._load_snapshot()
+        if time.time() - self._fetched_at > self.ttl:
+            self.refresh()
+        return self._topics
+
+    def refresh(self) -> None:
+        """Refetch the categories in the background, if not already doing so."""
+        if self._refresh_task and not self._refresh_task.done():
+            return
+        # Without a running event loop, the next access will try again
+        with contextlib.suppress(RuntimeError):
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh())
+
+    async def _refresh(self) -> None:
+        """Fetch the categories and write the snapshot."""
+        try:
+            topics = await fetch_categories()
+        except Exception:
+            logger.exception("Failed to refresh the opentdb categories.")
+            # Try again after a minute instead of on every access
+            self._fetched_at = time.time() - self.ttl + 60
+            return
+
+        self._topics, self._fetched_at = dict(topics), time.time()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_suffix(".tmp")
+        temporary.write_text(json.dumps({"fetched_at": self._fetched_at, "topics": self._topics}))
+        temporary.replace(self.path)
+
+    def _load_snapshot(self) -> None:
+        """Load the disk snapshot, or the bundled defaults if there is none."""
+        try:
+            snapshot = json.loads(self.path.read_text())
+            self._topics, self._fetched_at = snapshot["topics"], snapshot["fetched_at"]
+        except (OSError, ValueError, KeyError):
+            self._topics, self._fetched_at = dict(DEFAULT_CATEGORIES), 0.0
+
+
+catalogue = CategoryCatalogue(CACHE_DIR / "categories.json")
 
 
 def has_sub_topic(topic: str) -> bool:
     """Determine if the topic name has subtopics or not."""
-    return not isinstance(TOPICS_POOL[topic], int)
+    return not isinstance(catalogue.topics[topic], int)
 
 
 def get_topic_id(topic: str) -> int:
     """Return opentdb's root topic id from name."""
-    return TOPICS_POOL[topic]
+    return catalogue.topics[topic]
+
+
+def get_all_topic_ids(topic: str) -> list[int]:
+    """Return every opentdb id a quiz on this topic can draw questions from."""
+    return list(catalogue.topics[topic].values()) if has_sub_topic(topic) else [get_topic_id(topic)]
 
 
 def get_sub_topic_id(topic: str, topic_id_correct_count: dict) -> int:
     """Return subtopic id from name and possibly count of how many times the topic is correct."""
-    all_topic_ids = list(TOPICS_POOL[topic].values())
+    all_topic_ids = get_all_topic_ids(topic)
     if not topic_id_correct_count:
         return random.choice(all_topic_ids)  # noqa: S311
 
@@ -97,21 +213,24 @@ def create_api_call(
     return url
 
 
-def fetch_json(url: str) -> list:
-    """Fetch API from opentdb. Return False if bad response code."""
-    try:
-        response = requests.get(url, timeout=(3, 5))
-    except requests.exceptions.Timeout:
-        print("Timed out")
+class NoQuestionsError(Exception):
+    """Neither opentdb nor the question bank could provide the questions."""
 
-    if response.json()["response_code"] != 0:
-        return False
 
-    return response.json()["results"]
+async def fetch_json(url: str, max_wait: float | None = OPENTDB_QUEUE_TIME) -> dict | bool:
+    """Fetch API from opentdb. Return False if it is rate limited or did not answer in time."""
+    if not await opentdb_limiter.acquire(max_wait=max_wait):
+        logger.info("OpenTDB rate limit queue is full.")
+        return False
+    try:
+        return await http_client.get_json(url, timeout=OPENTDB_TIMEOUT, raise_for_status=False)
+    except (aiohttp.ClientError, TimeoutError, ValueError):
+        logger.warning("OpenTDB did not answer in time.")
+        return False
 
 
 def fetch_quizzes(json: list) -> list:
-    """Return list of quizzes based on json."""
+    """Return list of quizzes based on json and store them in the question bank."""
     quizzes = []
     for quiz in json:
         quiz["question"] = html.unescape(quiz["question"])
@@ -120,38 +239,140 @@ def fetch_quizzes(json: list) -> list:
 
         quizzes.append(quiz)
 
+    store_quizzes(quizzes)
     return quizzes
 
 
+def get_category_id(name: str) -> int | None:
+    """Return opentdb's category id from the category name used in its results."""
+    topic, _, subtopic = html.unescape(name).partition(": ")
+    topic_ids = catalogue.topics.get(topic)
+    return topic_ids.get(subtopic) if isinstance(topic_ids, dict) else topic_ids
+
+
+def store_quizzes(quizzes: list) -> None:
+    """Add unescaped quizzes to the local question bank, grouped by category."""
+    by_category = defaultdict(list)
+    for quiz in quizzes:
+        if (category := get_category_id(quiz["category"])) is not None:
+            by_category[category].append(quiz)
+
+    for category, group in by_category.items():
+        question_bank.add(group, category)
+
+
+def requested_amount(api_url: str) -> int:
+    """Return the number of questions an opentdb API call asks for."""
+    return int(parse_qs(urlsplit(api_url).query).get("amount", ["1"])[0])
+
+
+def sample_question_bank(api_url: str) -> list:
+    """Return quizzes matching an opentdb API call from the local question bank."""
+    query = parse_qs(urlsplit(api_url).query)
+
+    def param(name: str) -> str | None:
+        return query[name][0] if name in query else None
+
+    category = param("category")
+    return question_bank.sample(
+        requested_amount(api_url),
+        int(category) if category else None,
+        param("difficulty"),
+        param("type"),
+    )
+
+
 async def fetch_token() -> str:
     """Fetch a token from the API."""
     url = "https://opentdb.com/api_token.php?command=request"
-    async with aiohttp.ClientSession().get(url, timeout=3) as response:
-        return (await response.json())["token"]
+    await opentdb_limiter.acquire()
+    return (await http_client.get_json(url, timeout=3))["token"]
+
+
+class TokenManager:
+    """Opentdb session tokens per server, cached in memory and written through to the database."""
+
+    def __init__(self) -> None:
+        self._tokens: dict[int, str] = {}
+        self._refreshes = SingleFlight()
+
+    async def get(self, server_id: int) -> str:
+        """Return the token of the server, creating one if it has none."""
+        if (token := self._tokens.get(server_id)) is None:
+            token = await db.get_token(server_id) or await self.refresh(server_id)
+            self._tokens.setdefault(server_id, token)
+        return self._tokens[server_id]
+
+    async def refresh(self, server_id: int, stale: str | None = None) -> str:
+        """Replace an exhausted token. Concurrent callers share a single refresh."""
+        current = self._tokens.get(server_id)
+        if stale is not None and current is not None and current != stale:
+            # Someone already replaced it
+            return current
+        return await self._refreshes.do(server_id, lambda: self._replace(server_id))
+
+    async def _replace(self, server_id: int) -> str:
+        token = await fetch_token()
+        self._tokens[server_id] = token
+        await db.change_token(server_id, token)
+        return token
+
+
+tokens = TokenManager()
 
 
 async def get_quizzes_with_token(server_id: int, api_url: str) -> list:
-    """Return list of quizzes with token check."""
-    # If token exists
-    if current_token := await db.get_token(server_id):
-        # Current token works
-        if json := fetch_json(api_url + f"&token={current_token}"):
-            return fetch_quizzes(json)
+    """Return list of quizzes with token check.
+
+    Falls back to the local question bank if opentdb is slow, rate limited
+    or answers with any other non-zero response code. If the bank cannot
+    serve the call either, opentdb is waited for without a queue limit.
+    """
+    current_token = await tokens.get(server_id)
+    url = api_url + f"&token={current_token}"
+    response = await fetch_json(url)
+
+    # Current token no longer works
+    if response and response["response_code"] in TOKEN_ERRORS:
+        url = api_url + f"&token={await tokens.refresh(server_id, current_token)}"
+        response = await fetch_json(url)
+
+    if response and response["response_code"] == 0:
+        return fetch_quizzes(response["results"])
+
+    quizzes = sample_question_bank(api_url)
+    if len(quizzes) >= requested_amount(api_url):
+        logger.info("Serving questions for %s from the question bank.", api_url)
+        return quizzes
+
+    # Only a busy or slow opentdb is worth waiting for, other response codes would repeat
+    if response is False:
+        response = await fetch_json(url, max_wait=None)
+        if response and response["response_code"] == 0:
+            return fetch_quizzes(response["results"])
+
+    if not quizzes:
+        msg = f"No questions available for {api_url}"
+        raise NoQuestionsError(msg)
+    return quizzes
+
 
-        # Current token no longer works
-        await asyncio.sleep(5)
-        new_token = await fetch_token()
-        await db.change_token(server_id, new_token)
+def question_key(question: str) -> str:
+    """Return the cache key of a question: a hash of its normalized words."""
+    words = re.findall(r"\w+", question.casefold())
+    return hashlib.sha1(" ".join(words).encode()).hexdigest()  # noqa: S324
 
-        return fetch_quizzes(fetch_json(api_url + f"&token={new_token}"))
 
-    # No token yet
-    new_token = await fetch_token()
-    await db.change_token(server_id, new_token)
-    return fetch_quizzes(fetch_json(api_url + f"&token={new_token}"))
+async def wiki_search_url(question: str) -> str | None:
+    """Return the URL of the best Wikipedia search API result for the question."""
+    params = {"action": "query", "list": "search", "srsearch": question, "srlimit": 1, "format": "json"}
+    results = (await http_client.get_json(WIKI_API, params=params))["query"]["search"]
+    if not results:
+        return None
+    return WIKI_PAGE + quote(results[0]["title"].replace(" ", "_"))
 
 
-def learn_more_url(question: str) -> str:
+async def google_search_url(question: str) -> str | None:
     """Return the first Wikipedia Google search result URL for the question."""
     query = question + " site:en.wikipedia.org"
     url = "https://www.google.com/search"
@@ -163,9 +384,7 @@ def learn_more_url(question: str) -> str:
     }
     parameters = {"q": query}
 
-    response = requests.get(url, headers=headers, params=parameters, timeout=3)
-    response.raise_for_status()  # Raise an exception for HTTP errors
-    content = response.text
+    content = await http_client.get_text(url, headers=headers, params=parameters)
 
     soup = BeautifulSoup(content, "html.parser")
     search_results = soup.find_all("a")
@@ -176,8 +395,90 @@ def learn_more_url(question: str) -> str:
         if href and "en.wikipedia.org/wiki/" in href:
             return href
 
-    # Default return
-    return "https://en.wikipedia.org"
+    return None
+
+
+async def learn_more_url(question: str) -> str:
+    """Return a Wikipedia URL about the question, from the cache, Wikipedia search or Google."""
+    key = question_key(question)
+    if url := link_cache.get(key):
+        return url
+
+    try:
+        async with asyncio.timeout(LINK_TIMEOUT):
+            url = await wiki_search_url(question) or await google_search_url(question)
+    except (aiohttp.ClientError, TimeoutError, KeyError, ValueError):
+        url = None
+
+    # The default is not cached, so the lookup is retried the next time the question comes up
+    if not url:
+        return DEFAULT_LINK
+    link_cache.set(key, url)
+    return url
+
+
+class QuestionPrefetcher:
+    """Per-session question buffer, filled in the background while the current round runs."""
+
+    def __init__(self, server_id: int, topic: str, total: int, depth: int = PREFETCH_DEPTH) -> None:
+        self.server_id = server_id
+        self.remaining = total
+        self.depth = depth
+        self.buffers = {topic_id: deque() for topic_id in get_all_topic_ids(topic)}
+        self._fetches: dict[int, asyncio.Task] = {}
+        self._task: asyncio.Task | None = None
+
+    def fill(self) -> None:
+        """Top up the buffers in the background, if not already doing so."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._fill())
+
+    async def get(self, topic_id: int) -> dict:
+        """Return the next question for the topic id, fetching it right away if nothing is buffered."""
+        buffer = self.buffers.setdefault(topic_id, deque())
+        if not buffer:
+            # Only a fetch for this topic id is waited for, not the rest of the fill
+            await asyncio.shield(self._fetch_into(topic_id, 1))
+
+        quiz = buffer.popleft()
+        self.remaining -= 1
+        self.fill()
+        return quiz
+
+    def close(self) -> None:
+        """Stop any background fetch."""
+        if self._task:
+            self._task.cancel()
+        for fetch in self._fetches.values():
+            fetch.cancel()
+
+    async def _fill(self) -> None:
+        """Fetch questions for the emptiest buffers, up to `depth` each and the questions left in the quiz."""
+        while True:
+            needed = self.remaining - sum(map(len, self.buffers.values()))
+            topic_id = min(self.buffers, key=lambda topic_id: len(self.buffers[topic_id]))
+            missing = min(self.depth - len(self.buffers[topic_id]), needed)
+            if missing <= 0:
+                return
+            try:
+                await asyncio.shield(self._fetch_into(topic_id, missing))
+            except Exception:
+                logger.exception("Failed to prefetch questions for topic %s", topic_id)
+                return
+            if not self.buffers[topic_id]:
+                return
+
+    def _fetch_into(self, topic_id: int, amount: int) -> asyncio.Task:
+        """Return the running fetch for a topic id, or start one adding `amount` questions to its buffer."""
+        if (fetch := self._fetches.get(topic_id)) is None or fetch.done():
+            fetch = asyncio.create_task(self._fetch(topic_id, amount))
+            self._fetches[topic_id] = fetch
+        return fetch
+
+    async def _fetch(self, topic_id: int, amount: int) -> None:
+        """Fetch questions into a buffer, through the opentdb rate limit."""
+        quizzes = await get_quizzes_with_token(self.server_id, create_api_call(amount, topic_id))
+        self.buffers[topic_id].extend(quizzes)
 
 
 async def result_embed(interaction: discord.Interaction, participants: dict) -> discord.Embed:
@@ -188,10 +489,8 @@ async def result_embed(interaction: discord.Interaction, participants: dict) ->
         reverse=True,
     )[:3]
 
-    top_users = []
-    for user_id, score in top_participants:
-        user = await interaction.guild.fetch_member(user_id)
-        top_users.append((user.display_name, score))
+    names = await member_resolver.resolve(interaction.guild, [user_id for user_id, _ in top_participants])
+    top_users = [(names.get(user_id, f"<@{user_id}>"), score) for user_id, score in top_participants]
 
     if top_users:
         result_message = ""
@@ -0,0 +1,87 @@
+import asyncio
+import inspect
+import logging
+import math
+from collections.abc import Callable
+
+logger = logging.getLogger("scheduler")
+
+
+class Timer:
+    """Handle of a scheduled callback."""
+
+    __slots__ = ("callback", "cancelled", "deadline")
+
+    def __init__(self, deadline: int, callback: Callable) -> None:
+        self.deadline = deadline
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        """Prevent the callback from running."""
+        self.cancelled = True
+
+
+class TimerWheel:
+    """Hashed timer wheel driving every scheduled callback from a single task.
+
+    The driver only ticks while timers are pending and parks otherwise.
+    Callbacks returning an awaitable are run as short lived tasks.
+    """
+
+    def __init__(self, tick: float = 0.25, slots: int = 512) -> None:
+        self.tick = tick
+        self.slots: list[list[Timer]] = [[] for _ in range(slots)]
+        self.pending = 0
+        self._ticks = 0
+        self._wakeup: asyncio.Event | None = None
+        self._driver: asyncio.Task | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def schedule(self, delay: float, callback: Callable) -> Timer:
+        """Run `callback` after `delay` seconds, rounded up to the next tick."""
+        timer = Timer(self._ticks + max(1, math.ceil(delay / self.tick)), callback)
+        self.slots[timer.deadline % len(self.slots)].append(timer)
+        self.pending += 1
+
+        if self._driver is None or self._driver.done():
+            self._wakeup = asyncio.Event()
+            self._driver = asyncio.create_task(self._drive())
+        self._wakeup.set()
+        return timer
+
+    async def _drive(self) -> None:
+        """Advance the wheel one slot per tick and fire due timers."""
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            if not self.pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                next_tick = loop.time()
+
+            next_tick += self.tick
+            await asyncio.sleep(max(0, next_tick - loop.time()))
+            self._ticks += 1
+
+            slot = self.slots[self._ticks % len(self.slots)]
+            due = [timer for timer in slot if timer.deadline <= self._ticks]
+            slot[:] = [timer for timer in slot if timer.deadline > self._ticks]
+            self.pending -= len(due)
+            for timer in due:
+                if not timer.cancelled:
+                    self._fire(timer)
+
+    def _fire(self, timer: Timer) -> None:
+        try:
+            result = timer.callback()
+        except Exception:
+            logger.exception("Scheduled callback failed.")
+            return
+        if inspect.isawaitable(result):
+            task = asyncio.ensure_future(result)
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+
+scheduler = TimerWheel()
@@ -0,0 +1,86 @@
+import logging
+import time
+import uuid
+from dataclasses import dataclass
+
+from utils.database import Database, db
+
+logger = logging.getLogger("sessions")
+
+# Seconds a lease lives without being renewed
+LEASE_TTL = 60
+# Identifies leases taken by this process
+INSTANCE_ID = uuid.uuid4().hex
+
+
+@dataclass
+class Lease:
+    """Exclusive hold on a command in a channel."""
+
+    name: str
+    owner: str
+    expires_at: float
+
+    @property
+    def expired(self) -> bool:
+        """Whether the lease ran out without being renewed."""
+        return self.expires_at <= time.monotonic()
+
+
+class SessionRegistry:
+    """Channel leases for long running commands.
+
+    Leases are held in memory, so checking a busy channel needs no database
+    call. They are mirrored to Mongo with an expiry, so a lease left behind by
+    a crash frees itself instead of blocking the channel forever.
+    """
+
+    def __init__(self, database: Database, ttl: float = LEASE_TTL, owner: str = INSTANCE_ID) -> None:
+        self.database = database
+        self.ttl = ttl
+        self.owner = owner
+        self._leases: dict[str, Lease] = {}
+
+    def is_active(self, command: str, channel_id: int) -> bool:
+        """Return whether the command holds a live lease in the channel."""
+        lease = self._leases.get(f"{command}:{channel_id}")
+        return lease is not None and not lease.expired
+
+    async def acquire(self, command: str, channel_id: int) -> Lease | None:
+        """Take the channel for the command. Return None if it is already taken."""
+        if self.is_active(command, channel_id):
+            return None
+
+        # Reserve locally before awaiting, so concurrent calls cannot both get here
+        lease = Lease(f"{command}:{channel_id}", self.owner, time.monotonic() + self.ttl)
+        self._leases[lease.name] = lease
+        try:
+            acquired = await self.database.acquire_lease(lease.name, lease.owner, self.ttl)
+        except Exception:
+            logger.exception("Could not mirror lease %s, keeping it in memory only.", lease.name)
+            acquired = True
+
+        if not acquired:
+            del self._leases[lease.name]
+            return None
+        return lease
+
+    async def renew(self, lease: Lease) -> None:
+        """Extend the lease by another ttl."""
+        lease.expires_at = time.monotonic() + self.ttl
+        try:
+            await self.database.renew_lease(lease.name, lease.owner, self.ttl)
+        except Exception:
+            logger.exception("Could not renew lease %s.", lease.name)
+
+    async def release(self, lease: Lease) -> None:
+        """Give the channel back."""
+        if self._leases.get(lease.name) is lease:
+            del self._leases[lease.name]
+        try:
+            await self.database.release_lease(lease.name, lease.owner)
+        except Exception:
+            logger.exception("Could not release lease %s, it will expire on its own.", lease.name)
+
+
+sessions = SessionRegistry(db)
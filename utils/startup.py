@@ -0,0 +1,85 @@
+import re
+import subprocess
+import sys
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+# Imports listed in the startup report, slowest first
+REPORTED_IMPORTS = 15
+# One line of `python -X importtime` output: self and cumulative microseconds and the module name
+IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| +(\S+)")
+
+
+@dataclass
+class ImportTime:
+    """Seconds a module took to import, alone and with the modules it imported."""
+
+    module: str
+    self_time: float
+    cumulative: float
+
+
+def profile_imports(module: str) -> list[ImportTime]:
+    """Import a module in a fresh interpreter and return how long every import took, in import order."""
+    result = subprocess.run(  # noqa: S603
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    return [
+        ImportTime(name, int(self_time) / 1e6, int(cumulative) / 1e6)
+        for self_time, cumulative, name in IMPORT_TIME.findall(result.stderr)
+    ]
+
+
+class StartupProfiler:
+    """Time the setup phases of the bot, from the start of the run up to the gateway connection."""
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.started = time.perf_counter()
+        self.imports: list[ImportTime] = []
+        self.phases: list[tuple[str, float, float | None]] = []
+
+    def start(self, module: str) -> None:
+        """Enable profiling: time the imports of `module`, then time the phases from now on."""
+        self.enabled = True
+        self.imports = profile_imports(module)
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time a setup phase."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, started - self.started, time.perf_counter() - started))
+
+    def mark(self, name: str) -> None:
+        """Note the moment something happened."""
+        self.phases.append((name, time.perf_counter() - self.started, None))
+
+    def report(self) -> str:
+        """Return the import and phase timings as a readable table."""
+        lines = ["Startup profile"]
+        if self.imports:
+            total = max(entry.cumulative for entry in self.imports)
+            lines.append(f"Imports, in a fresh interpreter: {total:.3f}s")
+            slowest = sorted(self.imports, key=lambda entry: entry.self_time, reverse=True)
+            lines += [
+                f"    {entry.self_time:7.3f}s self {entry.cumulative:7.3f}s total  {entry.module}"
+                for entry in slowest[:REPORTED_IMPORTS]
+            ]
+
+        lines.append("Setup phases, seconds since the run started:")
+        for name, offset, duration in sorted(self.phases, key=lambda phase: phase[1]):
+            took = f"{duration:7.3f}s" if duration is not None else " " * 8
+            lines.append(f"    +{offset:7.3f}s {took}  {name}")
+        return "\n".join(lines)
+
+
+startup_profiler = StartupProfiler()
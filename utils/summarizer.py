@@ -0,0 +1,148 @@
+import asyncio
+import json
+import re
+from collections.abc import AsyncIterator
+
+import discord
+
+from utils.cache import CACHE_DIR, TieredCache
+from utils.gemini import CHARS_PER_TOKEN, gemini_client
+from utils.members import member_resolver
+from utils.messages import MessageRecord
+
+USER_TAG = re.compile(r"<@?(\d+)>")
+
+# Estimated tokens of conversation sent in one summary request
+CHUNK_TOKENS = 4000
+# Chunk summaries requested at once per summarization
+CHUNK_CONCURRENCY = 3
+# Seconds of conversation one chunk covers at most. Chunks start on these
+# boundaries, so overlapping ranges share every chunk but the outer ones
+CHUNK_PERIOD = 60 * 60
+# Seconds a chunk summary is reused
+CHUNK_SUMMARY_TTL = 7 * 24 * 60 * 60
+
+chunk_summaries = TieredCache(CACHE_DIR / "chunk_summaries.db", maxsize=512, ttl=CHUNK_SUMMARY_TTL)
+
+
+def read_summary(response: str) -> str | None:
+    """Return the summary of a Gemini summary response, if it has one."""
+    try:
+        data = json.loads(response)
+    except ValueError:
+        return None
+    return data.get("summary") if isinstance(data, dict) else None
+
+
+def convert_user_tags(content: str, names: dict[int, str]) -> str:
+    """Replace user tags with the display names of the users."""
+    return USER_TAG.sub(lambda match: names.get(int(match.group(1)), match.group(0)), content)
+
+
+def chunk_period(message_id: int) -> int:
+    """Return the chunk period a message was sent in."""
+    return int(discord.utils.snowflake_time(message_id).timestamp() // CHUNK_PERIOD)
+
+
+async def chunk_messages(
+    messages: AsyncIterator[MessageRecord],
+    budget: int = CHUNK_TOKENS * CHARS_PER_TOKEN,
+) -> AsyncIterator[list[MessageRecord]]:
+    """Group a stream of messages, oldest first, into chunks of at most `budget` characters."""
+    chunk = []
+    size = 0
+    async for message in messages:
+        # Content plus room for the author name
+        length = len(message.content) + 32
+        if chunk and (size + length > budget or chunk_period(message.id) != chunk_period(chunk[-1].id)):
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append(message)
+        size += length
+    if chunk:
+        yield chunk
+
+
+class ConversationSummarizer:
+    """Summarize long conversations map-reduce style.
+
+    The conversation is read as a stream and cut into chunks that fit one
+    prompt. Chunks are summarized concurrently while later ones are still
+    read, then the chunk summaries are combined into one.
+    """
+
+    def __init__(self, concurrency: int = CHUNK_CONCURRENCY, budget: int = CHUNK_TOKENS * CHARS_PER_TOKEN) -> None:
+        self.concurrency = concurrency
+        self.budget = budget
+
+    async def summarize(
+        self,
+        channel: discord.abc.Messageable,
+        messages: AsyncIterator[MessageRecord],
+    ) -> str | None:
+        """Return a summary of the messages of a channel, or None if it failed."""
+        limit = asyncio.Semaphore(self.concurrency)
+        tasks = []
+        try:
+            async for chunk in chunk_messages(messages, self.budget):
+                tasks.append(asyncio.create_task(self.summarize_chunk(channel, chunk, limit)))  # noqa: PERF401
+            summaries = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        if not summaries or not all(summaries):
+            return None
+        return await self.combine(summaries)
+
+    async def summarize_chunk(
+        self,
+        channel: discord.abc.Messageable,
+        chunk: list[MessageRecord],
+        limit: asyncio.Semaphore,
+    ) -> str | None:
+        """Return the summary of a chunk, reusing the one of the same messages if known."""
+        key = f"{channel.id}:{chunk[0].id}:{chunk[-1].id}"
+        if (summary := chunk_summaries.get(key)) is not None:
+            return summary
+
+        async with limit:
+            # Authors come with their names, tagged users are resolved at once
+            names = {message.author_id: message.author_name for message in chunk}
+            tagged = {int(user_id) for message in chunk for user_id in USER_TAG.findall(message.content)}
+            if tagged := tagged - names.keys():
+                names |= await member_resolver.resolve(channel.guild, list(tagged))
+            text = "\n".join(
+                f"{message.author_name}: {convert_user_tags(message.content, names)}" for message in chunk
+            )
+            summary = read_summary(await gemini_client.summarize_conversation(text))
+
+        if summary:
+            chunk_summaries.set(key, summary)
+        return summary
+
+    async def combine(self, summaries: list[str]) -> str | None:
+        """Combine summaries, in rounds of groups that fit one prompt, until a single one is left."""
+        while len(summaries) > 1:
+            groups = [[]]
+            size = 0
+            for summary in summaries:
+                if len(groups[-1]) > 1 and size + len(summary) > self.budget:
+                    groups.append([])
+                    size = 0
+                groups[-1].append(summary)
+                size += len(summary)
+            # Every group combines at least two summaries, so each round shrinks the list
+            if len(groups) > 1 and len(groups[-1]) == 1:
+                groups[-2] += groups.pop()
+
+            responses = await asyncio.gather(*(gemini_client.combine_summaries(group) for group in groups))
+            summaries = [read_summary(response) for response in responses]
+            if not all(summaries):
+                return None
+        return summaries[0]
+
+
+summarizer = ConversationSummarizer()
@@ -0,0 +1,160 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Callable, Hashable
+from dataclasses import dataclass
+from typing import TypeVar
+
+T = TypeVar("T")
+
+
+class RateLimiter:
+    """Space calls at least `interval` seconds apart, in the order they arrive."""
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self._next_slot = 0.0
+
+    @property
+    def idle(self) -> bool:
+        """Whether a call could go through right away."""
+        return self._next_slot <= asyncio.get_running_loop().time()
+
+    async def acquire(self, max_wait: float | None = None) -> bool:
+        """Wait for the next free slot. Return False at once if it is more than `max_wait` away."""
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next_slot)
+        if max_wait is not None and slot - now > max_wait:
+            return False
+
+        # Reserve the slot before sleeping, so later callers queue up behind it
+        self._next_slot = slot + self.interval
+        await asyncio.sleep(slot - now)
+        return True
+
+
+class SingleFlight:
+    """Share one in-flight call per key between every concurrent caller."""
+
+    def __init__(self) -> None:
+        self._calls: dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, function: Callable[[], Awaitable[T]]) -> T:
+        """Return the result of `function`, joining a running call with the same key."""
+        if (call := self._calls.get(key)) is None:
+            call = asyncio.ensure_future(function())
+            self._calls[key] = call
+            call.add_done_callback(lambda _: self._calls.pop(key, None))
+        # A cancelled caller must not cancel the call the others are waiting on
+        return await asyncio.shield(call)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+
+@dataclass
+class GovernorStats:
+    """Counters of a request governor."""
+
+    requests: int = 0
+    queued: int = 0
+    max_queue_depth: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    @property
+    def average_wait(self) -> float:
+        """Average time a request waited for its slot, in seconds."""
+        return self.total_wait / self.requests if self.requests else 0.0
+
+
+class RequestGovernor:
+    """Admit requests to a rate limited API by priority, within a concurrency limit and a per minute budget.
+
+    Lower priorities go first, requests of equal priority in arrival order.
+    The budget counts requests and (estimated) tokens over a sliding minute.
+    """
+
+    def __init__(self, concurrency: int, requests_per_minute: int, tokens_per_minute: int) -> None:
+        self.concurrency = concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.active = 0
+        self.stats = GovernorStats()
+        self._queue: list[tuple[int, int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._window: deque[tuple[float, int]] = deque()
+        self._window_tokens = 0
+        self._wakeup: asyncio.TimerHandle | None = None
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of requests waiting for a slot."""
+        return sum(not future.done() for *_, future in self._queue)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: int = 0, tokens: int = 0) -> AsyncIterator[None]:
+        """Hold a request slot for the duration of the block."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        future = loop.create_future()
+        heapq.heappush(self._queue, (priority, next(self._order), tokens, future))
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth, len(self._queue))
+        self._dispatch()
+        queued = not future.done()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as the caller gave up
+                self._release()
+            raise
+
+        wait = loop.time() - start
+        self.stats.requests += 1
+        self.stats.queued += queued
+        self.stats.total_wait += wait
+        self.stats.max_wait = max(self.stats.max_wait, wait)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self) -> None:
+        self.active -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Grant slots to the queued requests that fit the limits."""
+        loop = asyncio.get_running_loop()
+        while self._queue and self.active < self.concurrency:
+            _, _, tokens, future = self._queue[0]
+            if future.done():
+                heapq.heappop(self._queue)
+                continue
+            if (delay := self._budget_delay(loop.time(), tokens)) > 0:
+                if self._wakeup is None:
+                    self._wakeup = loop.call_later(delay, self._wake)
+                return
+
+            heapq.heappop(self._queue)
+            self.active += 1
+            self._window.append((loop.time(), tokens))
+            self._window_tokens += tokens
+            future.set_result(None)
+
+    def _wake(self) -> None:
+        self._wakeup = None
+        self._dispatch()
+
+    def _budget_delay(self, now: float, tokens: int) -> float:
+        """Return how long until a request of `tokens` tokens fits the budget."""
+        while self._window and self._window[0][0] <= now - 60:
+            self._window_tokens -= self._window.popleft()[1]
+        if not self._window:
+            return 0
+        if len(self._window) < self.requests_per_minute and self._window_tokens + tokens <= self.tokens_per_minute:
+            return 0
+        return self._window[0][0] + 60 - now
@@ -0,0 +1,157 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from collections import Counter, defaultdict
+from collections.abc import Awaitable, Callable, Iterator
+from functools import partial
+
+from utils.cache import TTLCache
+from utils.quiz import (
+    catalogue,
+    create_api_call,
+    fetch_json,
+    fetch_quizzes,
+    get_all_topic_ids,
+    opentdb_limiter,
+    question_bank,
+)
+from utils.throttle import RateLimiter
+from utils.wiki import get_wiki_image, get_wiki_summary, image_cache, normalize_title, summary_cache
+
+logger = logging.getLogger("warmer")
+
+# Topics kept warm per guild and kind of usage
+WARM_TOPICS = int(os.getenv("WARM_TOPICS", "5"))
+# Outbound requests the warmer may send per minute
+WARM_REQUESTS_PER_MINUTE = int(os.getenv("WARM_REQUESTS_PER_MINUTE", "6"))
+# Seconds between two warming rounds
+WARM_INTERVAL = 10 * 60
+# Seconds without commands before the bot counts as idle
+IDLE_TIME = 60
+# Questions a popular quiz category should have in the question bank
+POOL_SIZE = 50
+# Seconds before a topic that could not be fetched is tried again
+FAILED_TTL = 24 * 60 * 60
+# Topics remembered per guild, the least used ones are dropped beyond it
+MAX_TOPICS = 200
+
+SEARCH = "search"
+DISCUSS = "discuss"
+QUIZ = "quiz"
+
+
+class TopicUsage:
+    """How often every topic is used per guild, for the search, discuss and quiz commands."""
+
+    def __init__(self, max_topics: int = MAX_TOPICS) -> None:
+        self.max_topics = max_topics
+        self.counts: dict[tuple[int, str], Counter] = defaultdict(Counter)
+        self.last_activity = 0.0
+
+    def record(self, guild_id: int | None, kind: str, topic: str) -> None:
+        """Count a use of the topic. This also marks the bot as busy."""
+        self.last_activity = time.monotonic()
+        if guild_id is None:
+            return
+        counts = self.counts[guild_id, kind]
+        counts[topic.strip()] += 1
+        if len(counts) > 2 * self.max_topics:
+            self.counts[guild_id, kind] = Counter(dict(counts.most_common(self.max_topics)))
+
+    def top(self, kind: str, amount: int = WARM_TOPICS) -> list[str]:
+        """Return the most used topics of every guild for one kind, most used first."""
+        topics = Counter()
+        for (_, counted_kind), counts in self.counts.items():
+            if counted_kind == kind:
+                topics.update(dict(counts.most_common(amount)))
+        return [topic for topic, _ in topics.most_common()]
+
+    @property
+    def idle(self) -> bool:
+        """Whether no command was used recently."""
+        return time.monotonic() - self.last_activity > IDLE_TIME
+
+
+class CacheWarmer:
+    """Keep the caches of popular topics filled while the bot is idle.
+
+    Wikipedia summaries and images of popular /search and /discuss topics
+    and question bank pools of popular quiz categories are fetched ahead,
+    within a request budget and only while no live traffic is seen.
+    """
+
+    def __init__(self, usage: TopicUsage, requests_per_minute: int = WARM_REQUESTS_PER_MINUTE) -> None:
+        self.usage = usage
+        self.budget = RateLimiter(60 / requests_per_minute)
+        self.warmed = 0
+        self.failed = TTLCache(maxsize=1024, ttl=FAILED_TTL)
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Start warming in the background."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Stop warming."""
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(WARM_INTERVAL)
+            try:
+                await self.warm()
+            except Exception:
+                logger.exception("Cache warming failed.")
+
+    async def warm(self) -> None:
+        """Run one warming round, stopping as soon as live traffic is seen."""
+        for topic, fetch in self._cold_entries():
+            if not self.usage.idle:
+                return
+            await self.budget.acquire()
+            if not self.usage.idle:
+                return
+            try:
+                await fetch()
+                self.warmed += 1
+            except Exception as error:
+                logger.debug("Could not warm %s: %r", topic, error)
+                self.failed.set(topic, value=True)
+
+    def _cold_entries(self) -> Iterator[tuple[str, Callable[[], Awaitable]]]:
+        """Yield the fetches needed to warm the popular topics, one request each."""
+        topics = self.usage.top(SEARCH) + self.usage.top(DISCUSS)
+        for key in dict.fromkeys(normalize_title(topic) for topic in topics):
+            if self.failed.get(key):
+                continue
+            if summary_cache.get(key) is None:
+                yield key, partial(get_wiki_summary, key)
+            if image_cache.get(key) is None:
+                yield key, partial(get_wiki_image, key)
+
+        for topic in self.usage.top(QUIZ):
+            if topic not in catalogue.topics:
+                continue
+            for topic_id in get_all_topic_ids(topic):
+                if question_bank.count(topic_id) < POOL_SIZE:
+                    yield topic, partial(self._fill_pool, topic_id)
+
+    async def _fill_pool(self, topic_id: int) -> None:
+        # Live quizzes go first
+        if not opentdb_limiter.idle:
+            return
+        # No session token, so live quizzes of the guild can still be served these questions
+        response = await fetch_json(create_api_call(POOL_SIZE, topic_id))
+        if response and response["response_code"] == 0:
+            fetch_quizzes(response["results"])
+
+
+topic_usage = TopicUsage()
+warmer = CacheWarmer(topic_usage)
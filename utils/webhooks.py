@@ -0,0 +1,52 @@
+import logging
+
+import discord
+
+from utils.http import http_client
+from utils.throttle import SingleFlight
+
+logger = logging.getLogger("webhooks")
+
+WEBHOOK_NAME = "Discussion"
+
+
+class WebhookRegistry:
+    """Remember one usable webhook per channel, so sending through it needs no lookup."""
+
+    def __init__(self) -> None:
+        self.webhooks: dict[int, discord.Webhook] = {}
+        self._lookups = SingleFlight()
+
+    async def get(self, channel: discord.TextChannel) -> discord.Webhook:
+        """Return the webhook of a channel, finding or creating it on first use."""
+        if (webhook := self.webhooks.get(channel.id)) is not None:
+            return webhook
+        return await self._lookups.do(channel.id, lambda: self._find(channel))
+
+    def invalidate(self, channel_id: int) -> None:
+        """Forget the webhook of a channel."""
+        self.webhooks.pop(channel_id, None)
+
+    async def send(self, channel: discord.TextChannel, **kwargs: object) -> None:
+        """Send a message through the webhook of a channel, replacing the webhook if it was deleted."""
+        webhook = await self.get(channel)
+        try:
+            await webhook.send(**kwargs)
+        except discord.NotFound:
+            logger.info("Webhook of channel %s is gone, looking up another one.", channel.id)
+            self.invalidate(channel.id)
+            webhook = await self.get(channel)
+            await webhook.send(**kwargs)
+
+    async def _find(self, channel: discord.TextChannel) -> discord.Webhook:
+        webhook = next((webhook for webhook in await channel.webhooks() if webhook.token), None)
+        if webhook is None:
+            webhook = await channel.create_webhook(name=WEBHOOK_NAME)
+
+        # Send through the shared connection pool
+        webhook = discord.Webhook.from_url(webhook.url, session=http_client.session)
+        self.webhooks[channel.id] = webhook
+        return webhook
+
+
+webhook_registry = WebhookRegistry()
@@ -1,61 +1,261 @@
-import os
+import asyncio
+import bisect
+import codecs
+import contextlib
+import hashlib
+import json
+import logging
 import random
 import re
+from array import array
+from collections.abc import Iterator, Sequence
+from html.parser import HTMLParser
+from urllib.parse import quote
 
-import google.generativeai as genai
-import requests
+import aiohttp
 import wikipedia
-from bs4 import BeautifulSoup
-from dotenv import load_dotenv
 
-load_dotenv()
-GEMINI_KEY = os.getenv("GOOGLE_API_KEY")
-WIKI_REQUEST = "http://en.wikipedia.org/w/api.php?action=query&prop=pageimages&format=json&piprop=original&titles="
+from utils.cache import CACHE_DIR, TieredCache
+from utils.gemini import gemini_client
+from utils.http import http_client
+from utils.throttle import SingleFlight
 
+logger = logging.getLogger("wiki")
 
-genai.configure(api_key=GEMINI_KEY)
-model = genai.GenerativeModel("gemini-1.5-flash")
+WIKI_API = "https://en.wikipedia.org/w/api.php"
+WIKI_PAGE = "https://en.wikipedia.org/wiki/"
+WIKI_REQUEST = "https://en.wikipedia.org/w/api.php?action=query&prop=pageimages&format=json&formatversion=2&redirects=1&piprop=original&titles="
+# Seconds a fetched article summary is reused
+SUMMARY_TTL = 7 * 24 * 60 * 60
+# Seconds to wait for the summary of an article
+SUMMARY_TIMEOUT = 5
+# Seconds to wait for images of an article
+IMAGE_TIMEOUT = 3
+# Seconds an article without image is remembered, articles with one are kept for the cache TTL
+NO_IMAGE_TTL = 24 * 60 * 60
+# Seconds to collect titles into one pageimages request, and the most titles the API accepts
+IMAGE_BATCH_DELAY = 0.05
+IMAGE_BATCH_SIZE = 50
+# Seconds a generated false statement is reused
+FALSE_STATEMENT_TTL = 30 * 24 * 60 * 60
 
+summary_cache = TieredCache(CACHE_DIR / "summaries.db", maxsize=512, ttl=SUMMARY_TTL)
+summary_fetches = SingleFlight()
+image_cache = TieredCache(CACHE_DIR / "images.db", maxsize=1024, ttl=SUMMARY_TTL)
+image_fetches = SingleFlight()
+false_statement_cache = TieredCache(CACHE_DIR / "false_statements.db", maxsize=2048, ttl=FALSE_STATEMENT_TTL)
 
-def get_wiki_facts(prompt: str, number: int = 5) -> list:
+
+def normalize_title(title: str) -> str:
+    """Return the title the way Wikipedia normalizes it."""
+    title = " ".join(title.replace("_", " ").split())
+    return title[:1].upper() + title[1:]
+
+
+async def fetch_summary(title: str) -> list[str]:
+    """Fetch the introduction of an article, split into sentences.
+
+    Raises the same errors as `wikipedia.summary`.
+    """
+    params = {
+        "action": "query",
+        "prop": "extracts|pageprops",
+        "exintro": 1,
+        "explaintext": 1,
+        "ppprop": "disambiguation",
+        "redirects": 1,
+        "titles": title,
+        "format": "json",
+        "formatversion": 2,
+    }
+    response = await http_client.get_json(WIKI_API, params=params, timeout=SUMMARY_TIMEOUT)
+    page = response["query"]["pages"][0]
+    if page.get("missing") or page.get("invalid"):
+        raise wikipedia.PageError(title)
+    if "disambiguation" in page.get("pageprops", {}):
+        raise wikipedia.DisambiguationError(page["title"], [])
+    return split_into_sentences(page.get("extract", ""))
+
+
+async def get_wiki_summary(title: str) -> list[str]:
+    """Return the sentences of an article introduction, cached per title."""
+    key = normalize_title(title)
+    if (sentences := summary_cache.get(key)) is not None:
+        return sentences
+
+    async def fetch() -> list[str]:
+        sentences = await fetch_summary(key)
+        summary_cache.set(key, sentences)
+        return sentences
+
+    return await summary_fetches.do(key, fetch)
+
+
+async def get_wiki_facts(prompt: str, number: int = 5) -> list:
     """Return {number} amount of facts based on {prompt}."""
-    return random.sample(split_into_sentences(wikipedia.summary(prompt, auto_suggest=False)), k=number)
+    return random.sample(await get_wiki_summary(prompt), k=number)
+
+
+def fact_key(fact: str) -> str:
+    """Return the cache key of a fact: a hash of its normalized words."""
+    words = re.findall(r"\w+", fact.casefold())
+    return hashlib.sha1(" ".join(words).encode()).hexdigest()  # noqa: S324
+
+
+async def create_false_statements(facts: list[str]) -> list[str | None]:
+    """Return a false statement for every fact, or None where none could be made.
+
+    Facts without a cached statement are sent to Gemini in one request.
+    """
+    keys = [fact_key(fact) for fact in facts]
+    statements = [false_statement_cache.get(key) for key in keys]
+    misses = list(dict.fromkeys(fact for fact, statement in zip(facts, statements, strict=True) if statement is None))
+    if not misses:
+        return statements
+
+    try:
+        variants = json.loads(await gemini_client.create_false_statements(misses))
+    except ValueError:
+        variants = None
+    if not (isinstance(variants, list) and len(variants) == len(misses) and all(isinstance(v, str) for v in variants)):
+        logger.warning("Gemini returned unusable false statements: %r", variants)
+        return statements
+
+    for fact, variant in zip(misses, variants, strict=True):
+        false_statement_cache.set(fact_key(fact), variant)
+    return [false_statement_cache.get(key) for key in keys]
+
+
+class PageImageBatcher:
+    """Look up lead images through the pageimages API, batching titles requested together into one call."""
+
+    def __init__(self, delay: float = IMAGE_BATCH_DELAY, size: int = IMAGE_BATCH_SIZE) -> None:
+        self.delay = delay
+        self.size = size
+        self._pending: dict[str, asyncio.Future] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def get(self, title: str) -> tuple[str | None, str | None]:
+        """Return the resolved title and lead image of an article. The title is None if it does not exist."""
+        if (future := self._pending.get(title)) is None:
+            loop = asyncio.get_running_loop()
+            future = self._pending[title] = loop.create_future()
+            if len(self._pending) >= self.size:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.delay, self._flush)
+        return await asyncio.shield(future)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        task = asyncio.create_task(self._request(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _request(self, batch: dict[str, asyncio.Future]) -> None:
+        try:
+            response = await http_client.get_json(WIKI_REQUEST + quote("|".join(batch)), timeout=IMAGE_TIMEOUT)
+        except Exception as error:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        query = response.get("query", {})
+        aliases = {alias["from"]: alias["to"] for alias in query.get("normalized", []) + query.get("redirects", [])}
+        pages = {page["title"]: page for page in query.get("pages", [])}
+        for title, future in batch.items():
+            # Follow normalization, then the redirect
+            resolved = aliases.get(title, title)
+            resolved = aliases.get(resolved, resolved)
+            page = pages.get(resolved)
+            if page is None or page.get("missing") or page.get("invalid"):
+                result = (None, None)
+            else:
+                result = (page["title"], page.get("original", {}).get("source"))
+            if not future.done():
+                future.set_result(result)
+
+
+image_batcher = PageImageBatcher()
+
 
+class InfoboxImageParser(HTMLParser):
+    """Incremental parser finding the first image of an article's infobox."""
 
-def create_false_statement(fact: str) -> str:
-    """Get a false fact based on a true fact."""
-    prompt = f"Create a false fact for a True False quiz based on this fact: {fact} in one line. Answer directly and only the false statement."  # noqa: E501
-    response = model.generate_content(prompt)
-    return response.text
+    def __init__(self) -> None:
+        super().__init__()
+        self.depth = 0
+        self.image: str | None = None
+        self.done = False
 
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        """Track infobox tables and pick its first file image."""
+        if self.done:
+            return
+        attributes = dict(attrs)
+        classes = (attributes.get("class") or "").split()
+        if tag == "table":
+            if self.depth:
+                self.depth += 1
+            elif "infobox" in classes:
+                self.depth = 1
+        elif tag == "img" and self.depth and "mw-file-element" in classes:
+            self.image = attributes.get("src")
+            self.done = True
 
-def get_wiki_image(search_term: str) -> str | bool:
+    def handle_endtag(self, tag: str) -> None:
+        """Stop once the infobox closed without an image."""
+        if tag == "table" and self.depth:
+            self.depth -= 1
+            self.done = not self.depth
+
+
+async def scrape_infobox_image(title: str) -> str | None:
+    """Return the infobox image of an article, reading its HTML only up to the infobox."""
+    parser = InfoboxImageParser()
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    url = WIKI_PAGE + quote(title.replace(" ", "_"))
+    async with contextlib.aclosing(http_client.stream(url, timeout=IMAGE_TIMEOUT)) as chunks:
+        async for chunk in chunks:
+            parser.feed(decoder.decode(chunk))
+            if parser.done:
+                break
+
+    if (image_url := parser.image) and image_url.startswith("//"):
+        image_url = "https:" + image_url
+    return image_url
+
+
+async def find_wiki_image(title: str) -> str | None:
+    """Return the lead image of an article, falling back to its infobox."""
+    resolved, image_url = await image_batcher.get(title)
+    if resolved and not image_url:
+        # Pageimages skips non-free images, which infoboxes often use
+        image_url = await scrape_infobox_image(resolved)
+    return image_url
+
+
+async def get_wiki_image(search_term: str) -> str | bool:
     """Return featured image URL of search."""
+    key = normalize_title(search_term)
+    if (image_url := image_cache.get(key)) is not None:
+        return image_url or False
+
+    async def fetch() -> str:
+        image_url = await find_wiki_image(key) or ""
+        # Articles without image are remembered for a shorter time
+        image_cache.set(key, image_url, ttl=None if image_url else NO_IMAGE_TTL)
+        return image_url
+
     try:
-        wikipedia.set_lang("en")
-        result = wikipedia.search(search_term, results=1)
-        if not result:
-            return False
-
-        wkpage = wikipedia.WikipediaPage(title=result[0])
-        response = requests.get(wkpage.url, timeout=3)
-        response.raise_for_status()
-
-        soup = BeautifulSoup(response.text, "html.parser")
-        infobox = soup.find("table", {"class": "infobox"})
-        if not infobox:
-            return False
-
-        image_tag = infobox.find("img", class_="mw-file-element")
-        if not image_tag:
-            return False
-
-        image_url = image_tag["src"]
-        if image_url.startswith("//"):
-            image_url = "https:" + image_url
-
-        return image_url  # noqa: TRY300
-    except Exception:
+        return await image_fetches.do(key, fetch) or False
+    except (aiohttp.ClientError, TimeoutError, ValueError) as error:
+        logger.warning("Image lookup for %s failed: %r", key, error)
         return False
 
 
@@ -72,51 +272,106 @@ digits = "([0-9])"
 multiple_dots = r"\.{2,}"
 
 
+# Markers of periods that do not end a sentence, and of sentence ends
+PRD = "\ue000"
+STOP = "\ue001"
+
+# The patterns below start with the period where they can, so the regex engine can skip
+# ahead to the next period. Lookbehinds only check text the original patterns consumed.
+PREFIX_PERIODS = re.compile(r"\.(?:(?<=Mr\.)|(?<=Mrs\.)|(?<=St\.)|(?<=Ms\.)|(?<=Dr\.))")
+WEBSITE_PERIODS = re.compile(websites)
+DECIMAL_PERIODS = re.compile(digits + "[.]" + digits)
+MULTIPLE_DOTS = re.compile(multiple_dots)
+INITIAL_PERIODS = re.compile(r"\s" + alphabets + "[.] ")
+ACRONYM_ENDS = re.compile(acronyms + " " + starters)
+# Both "A.B.C." and "A.B." in one pass, the longer form first like the two passes they replace
+LETTER_GROUP_PERIODS = re.compile(r"\.(?<=[A-Za-z]\.)[A-Za-z]\.(?:[A-Za-z]\.)?")
+SUFFIX_ENDS = re.compile(" " + suffixes + "[.] " + starters)
+SUFFIX_PERIODS = re.compile(" " + suffixes + "[.]")
+LETTER_PERIODS = re.compile(" " + alphabets + "[.]")
+SENTENCE_ENDS = re.compile(f"[.?!{STOP}]")
+STOP_MARKERS = re.compile(STOP)
+NON_SPACE = re.compile(r"\S")
+
+
+def mark_periods(text: str) -> str:
+    """Normalize the text, marking every period that does not end a sentence and every unpunctuated end."""
+    text = " " + text.replace("\n", " ") + "  "
+    if "." not in text:
+        return text
+
+    text = PREFIX_PERIODS.sub(PRD, text)
+    text = WEBSITE_PERIODS.sub(PRD + "\\1", text)
+    text = DECIMAL_PERIODS.sub("\\1" + PRD + "\\2", text)
+    text = MULTIPLE_DOTS.sub(lambda match: PRD * len(match.group(0)) + STOP, text)
+    if "Ph.D" in text:
+        text = text.replace("Ph.D.", "Ph" + PRD + "D" + PRD)
+    text = INITIAL_PERIODS.sub(" \\1" + PRD + " ", text)
+    text = ACRONYM_ENDS.sub("\\1" + STOP + " \\2", text)
+    text = LETTER_GROUP_PERIODS.sub(lambda match: match.group(0).replace(".", PRD), text)
+    text = SUFFIX_ENDS.sub(" \\1" + STOP + " \\2", text)
+    text = SUFFIX_PERIODS.sub(" \\1" + PRD, text)
+    return LETTER_PERIODS.sub(" \\1" + PRD, text)
+
+
+class Sentences(Sequence[str]):
+    """Sentences of a text, kept as spans of its normalized form and only copied out when accessed.
+
+    If the text contains the private use characters U+E000 or U+E001, they
+    would lead to incorrect splitting because they are used as markers.
+    """
+
+    def __init__(self, text: str) -> None:
+        text = mark_periods(text)
+        if "\u201d" in text:
+            text = text.replace(".\u201d", "\u201d.")
+        if '"' in text:
+            text = text.replace('."', '".').replace('!"', '"!').replace('?"', '"?')
+        self.text = text
+
+        # Sentences end after every ".", "?" and "!", and at every end marker. Only their
+        # offsets are kept, no sentence is copied out
+        self.ends = array("l", (match.end() for match in SENTENCE_ENDS.finditer(text)))
+        self.starts = array("l", [0])
+        self.starts.extend(self.ends)
+        if STOP in text:
+            # End markers belong to neither sentence
+            for match in STOP_MARKERS.finditer(text):
+                self.ends[bisect.bisect_left(self.ends, match.end())] -= 1
+        # The text after the last end is a sentence too, unless it is only whitespace
+        if NON_SPACE.search(text, self.starts[-1]):
+            self.ends.append(len(text))
+        else:
+            self.starts.pop()
+
+    def __len__(self) -> int:
+        return len(self.ends)
+
+    def __getitem__(self, index: int) -> str:
+        start, end = self.span(index)
+        return self.text[start:end].replace(PRD, ".").strip()
+
+    def __iter__(self) -> Iterator[str]:
+        text = self.text.replace(PRD, ".")
+        return (text[start:end].strip() for start, end in zip(self.starts, self.ends, strict=True))
+
+    def span(self, index: int) -> tuple[int, int]:
+        """Return where a sentence starts and ends in the normalized text."""
+        index = range(len(self))[index]
+        return self.starts[index], self.ends[index]
+
+    def sample(self, k: int) -> list[str]:
+        """Return `k` random sentences, copying out only those."""
+        return [self[i] for i in random.sample(range(len(self)), k)]
+
+
 def split_into_sentences(text: str) -> list[str]:
     """Split the text into sentences.
 
-    If the text contains substrings "<prd>" or "<stop>", they would lead
-    to incorrect splitting because they are used as markers for splitting.
-
     :param text: text to be split into sentences
     :type text: str
 
     :return: list of sentences
     :rtype: list[str]
     """
-    text = " " + text + "  "
-    text = text.replace("\n", " ")
-    text = re.sub(prefixes, "\\1<prd>", text)
-    text = re.sub(websites, "<prd>\\1", text)
-    text = re.sub(digits + "[.]" + digits, "\\1<prd>\\2", text)
-    text = re.sub(multiple_dots, lambda match: "<prd>" * len(match.group(0)) + "<stop>", text)
-    if "Ph.D" in text:
-        text = text.replace("Ph.D.", "Ph<prd>D<prd>")
-    text = re.sub(r"\s" + alphabets + "[.] ", " \\1<prd> ", text)
-    text = re.sub(acronyms + " " + starters, "\\1<stop> \\2", text)
-    text = re.sub(
-        alphabets + "[.]" + alphabets + "[.]" + alphabets + "[.]",
-        "\\1<prd>\\2<prd>\\3<prd>",
-        text,
-    )
-    text = re.sub(alphabets + "[.]" + alphabets + "[.]", "\\1<prd>\\2<prd>", text)
-    text = re.sub(" " + suffixes + "[.] " + starters, " \\1<stop> \\2", text)
-    text = re.sub(" " + suffixes + "[.]", " \\1<prd>", text)
-    text = re.sub(" " + alphabets + "[.]", " \\1<prd>", text)
-    if "”" in text:
-        text = text.replace(".”", "”.")
-    if '"' in text:
-        text = text.replace('."', '".')
-    if "!" in text:
-        text = text.replace('!"', '"!')
-    if "?" in text:
-        text = text.replace('?"', '"?')
-    text = text.replace(".", ".<stop>")
-    text = text.replace("?", "?<stop>")
-    text = text.replace("!", "!<stop>")
-    text = text.replace("<prd>", ".")
-    sentences = text.split("<stop>")
-    sentences = [s.strip() for s in sentences]
-    if sentences and not sentences[-1]:
-        sentences = sentences[:-1]
-    return sentences
+    return list(Sentences(text))